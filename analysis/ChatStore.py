@@ -0,0 +1,233 @@
+from utill import iso2sec
+from array import array
+from collections import OrderedDict, Counter
+from collections.abc import Mapping
+from typing import Iterable, List
+import csv
+import sys
+
+
+# Columns with few distinct values, which are stored as integer codes.
+ENCODED_KEYS = ('time_stamp', 'author_name', 'img')
+
+
+class EncodedColumn:
+
+    def __init__(self, values: Iterable = tuple()):
+        """
+        Column of repetitive values (e.g. author names, languages), stored as codes of unique values.
+
+        Attributes:
+            values (list): code -> value, each distinct value is stored once.
+            value_to_code (dict): value -> code
+            codes (array): code of each row
+        """
+        self.values: list = []
+        self.value_to_code: dict = {}
+        self.codes = array('I')
+        for value in values:
+            self.append(value)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, idx):
+        return self.values[self.codes[idx]]
+
+    def __setitem__(self, idx, value):
+        self.codes[idx] = self.encode(value)
+
+    def __iter__(self):
+        values = self.values
+        return (values[code] for code in self.codes)
+
+    def encode(self, value) -> int:
+        code = self.value_to_code.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self.value_to_code[value] = code
+        return code
+
+    def append(self, value):
+        self.codes.append(self.encode(value))
+
+
+def is_encodable(values: list) -> bool:
+    return all((v is None) or isinstance(v, str) for v in values)
+
+
+class ChatStore:
+
+    def __init__(self):
+        """
+        Column-oriented store of chat lines.
+
+        Attributes:
+            columns (OrderedDict): key -> EncodedColumn or list
+            time_stamp_secs (array): time_stamp of each line in sec, -1 if it cannot be parsed
+            is_edited (bool): whether a value is set by set_value (e.g. ChatLine.__setitem__),
+                which cannot be rebuilt from the chat file and feature recipes
+            version (int): the number of changes by set_column and set_value, to invalidate what is computed from it
+        """
+        self.columns: OrderedDict = OrderedDict()
+        self.time_stamp_secs = array('l')
+        self.is_edited = False
+        self.version = 0
+
+    @classmethod
+    def from_csv(cls, path: str):
+        store = cls()
+        with open(path, 'r', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            fieldnames = next(reader, [])
+            column_list = [EncodedColumn() if k in ENCODED_KEYS else [] for k in fieldnames]
+            for row in reader:
+                # Blank lines are skipped, and missing values are None as in csv.DictReader.
+                if not row:
+                    continue
+                row = row + [None] * (len(fieldnames) - len(row))
+                for column, value in zip(column_list, row):
+                    column.append(value)
+        store.columns = OrderedDict(zip(fieldnames, column_list))
+        store.parse_time_stamps()
+        return store
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def keys(self) -> list:
+        return list(self.columns.keys())
+
+    def nbytes(self) -> int:
+        """
+        :return: approximate memory of the store in bytes
+        """
+        r = self.time_stamp_secs.itemsize * len(self.time_stamp_secs)
+        for column in self.columns.values():
+            if isinstance(column, EncodedColumn):
+                r += column.codes.itemsize * len(column.codes) + sys.getsizeof(column.value_to_code)
+                r += sum(sys.getsizeof(v) for v in column.values)
+            else:
+                r += sys.getsizeof(column) + sum(sys.getsizeof(v) for v in column)
+        return r
+
+    def parse_time_stamps(self):
+        """
+        Parse each distinct time_stamp once, e.g. '1:01:02' -> 3662
+        """
+        if 'time_stamp' not in self.columns:
+            return
+
+        column = self.columns['time_stamp']
+        code_to_sec = []
+        for time_stamp in column.values:
+            try:
+                code_to_sec.append(iso2sec(time_stamp) if not time_stamp.startswith('-') else -1)
+            except Exception:
+                code_to_sec.append(-1)
+        self.time_stamp_secs = array('l', (code_to_sec[code] for code in column.codes))
+
+    def set_column(self, key: str, values: List):
+        """
+        :param key: str
+        :param values: list of values whose length is len(self), stored as EncodedColumn if all are str or None
+        """
+        self.columns[key] = EncodedColumn(values) if is_encodable(values) else list(values)
+        self.version += 1
+
+    def set_value(self, key: str, idx: int, value):
+        self.is_edited = True
+        self.version += 1
+        if key not in self.columns:
+            self.columns[key] = [None] * len(self)
+        column = self.columns[key]
+        if isinstance(column, EncodedColumn) and not ((value is None) or isinstance(value, str)):
+            column = self.columns[key] = list(column)
+        column[idx] = value
+
+    def count_column(self, key: str) -> Counter:
+        """
+        :return: value -> the number of lines, counted on codes without building values of lines
+        """
+        column = self.columns[key]
+        if not isinstance(column, EncodedColumn):
+            return Counter(column)
+        return Counter({column.values[code]: count for code, count in Counter(column.codes).items()})
+
+
+class ChatLine(Mapping):
+
+    __slots__ = ('store', 'idx')
+
+    def __init__(self, store: ChatStore, idx: int):
+        """
+        Row view of a ChatStore, which works like OrderedDict of a line.
+        """
+        self.store = store
+        self.idx = idx
+
+    def __getitem__(self, key):
+        return self.store.columns[key][self.idx]
+
+    def __setitem__(self, key, value):
+        self.store.set_value(key, self.idx, value)
+
+    def __iter__(self):
+        return iter(self.store.columns)
+
+    def __len__(self):
+        return len(self.store.columns)
+
+    def __repr__(self):
+        return repr(OrderedDict(self.items()))
+
+
+class ChatStoreCache:
+
+    def __init__(self, memory_budget_in_mb: float = None):
+        """
+        LRU cache of ChatStores. The least recently used stores are evicted when the sum of
+        ChatStore.nbytes() is over the budget, but the most recently used one is always kept.
+        Edited stores (ChatStore.is_edited) are never evicted, since their edits would be lost.
+        :param memory_budget_in_mb: None for no limit
+        """
+        self.memory_budget = memory_budget_in_mb * 1024 * 1024 if memory_budget_in_mb else None
+        self.key_to_store: OrderedDict = OrderedDict()
+        self.key_to_nbytes: dict = {}
+
+    def __len__(self):
+        return len(self.key_to_store)
+
+    def __contains__(self, key):
+        return key in self.key_to_store
+
+    def get_nbytes(self) -> int:
+        return sum(self.key_to_nbytes.values())
+
+    def get(self, key) -> ChatStore or None:
+        store = self.key_to_store.get(key)
+        if store is not None:
+            self.key_to_store.move_to_end(key)
+        return store
+
+    def put(self, key, store: ChatStore):
+        self.key_to_store[key] = store
+        self.key_to_store.move_to_end(key)
+        self.key_to_nbytes[key] = store.nbytes()
+        self.evict()
+
+    def update_nbytes(self, key):
+        if key in self.key_to_store:
+            self.key_to_nbytes[key] = self.key_to_store[key].nbytes()
+            self.evict()
+
+    def evict(self):
+        if self.memory_budget is None:
+            return
+        evictable_keys = [key for key, store in list(self.key_to_store.items())[:-1] if not store.is_edited]
+        for key in evictable_keys:
+            if self.get_nbytes() <= self.memory_budget:
+                break
+            del self.key_to_store[key]
+            del self.key_to_nbytes[key]
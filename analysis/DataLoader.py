@@ -1,14 +1,113 @@
 from custom_path import DATA_PATH, CHAT_PATH
 from utill import get_files_with_dir_path, try_except
-from typing import List, Dict, Callable
-from collections import OrderedDict
+from ChatStore import ChatStore, ChatStoreCache, ChatLine
+from FeatureCache import FeatureCache
+from typing import List, Dict, Callable, Set
+from collections import defaultdict, deque
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+import multiprocessing
 import csv
 import os
+import sys
+
+# executor_options of add_feature
+#   executor: None (in this process), 'thread' or 'process'
+#   workers: number of workers, None for the number of CPUs
+#   chunk_size: number of lines per chunk, None for a whole match per chunk
+#   batch: if True, feature_func takes a chunk, def func(lines: List[ChatLine], args): ... -> list of values
+DEFAULT_EXECUTOR_OPTIONS = {
+    'executor': None,
+    'workers': None,
+    'chunk_size': 10000,
+    'batch': False,
+}
+
+# (feature_func, args, batch) of the running add_feature with 'process' executor.
+# Forked workers inherit it, since feature functions can be closures (e.g. have_enough_words) that cannot be pickled.
+_FEATURE_TASK = None
+
+
+def compute_feature_chunk(lines: list, task: tuple = None) -> tuple:
+    """
+    :param lines: list of ChatLine or dict
+    :param task: (feature_func, args, batch), _FEATURE_TASK if None
+    :return: (values, errors) where the value of a line that raises is None
+    """
+    feature_func, args, batch = task or _FEATURE_TASK
+    if batch:
+        try:
+            return list(feature_func(lines, *args)), []
+        except Exception as e:
+            return [None] * len(lines), ['{0}: {1}'.format(e.__class__.__name__, e)] * len(lines)
+
+    values, errors = [], []
+    for line in lines:
+        try:
+            values.append(feature_func(line, *args))
+        except Exception as e:
+            values.append(None)
+            errors.append('{0}: {1}'.format(e.__class__.__name__, e))
+    return values, errors
+
+
+def compute_feature_values(lines_list: List[list], feature_func: Callable, args: tuple = tuple(),
+                           executor_options: dict = None) -> List[tuple]:
+    """
+    :param lines_list: lines of each match
+    :param feature_func: def func(line: ChatLine, args): ..., or def func(lines: List[ChatLine], args): ... if batch
+    :param args: tuple
+    :param executor_options: see DEFAULT_EXECUTOR_OPTIONS
+    :return: (values, errors of each chunk) of each match, in the order of lines_list
+    """
+    global _FEATURE_TASK
+    options = dict(DEFAULT_EXECUTOR_OPTIONS, **(executor_options or {}))
+    chunk_size = options['chunk_size']
+    task = (feature_func, args, options['batch'])
+
+    match_and_chunk_list = []
+    for match_idx, lines in enumerate(lines_list):
+        size = chunk_size or max(len(lines), 1)
+        for begin in range(0, len(lines), size):
+            match_and_chunk_list.append((match_idx, lines[begin:begin + size]))
+    chunk_list = [chunk for _, chunk in match_and_chunk_list]
+
+    if options['executor'] is None:
+        result_list = [compute_feature_chunk(chunk, task) for chunk in chunk_list]
+    elif options['executor'] == 'thread':
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            result_list = list(executor.map(partial(compute_feature_chunk, task=task), chunk_list))
+    elif options['executor'] == 'process':
+        _FEATURE_TASK = task
+        try:
+            with ProcessPoolExecutor(max_workers=options['workers'],
+                                     mp_context=multiprocessing.get_context('fork')) as executor:
+                # Lines are copied into dicts only when their chunk is submitted,
+                # and at most two chunks per worker are in flight, so copies do not pile up in this process.
+                max_pending = 2 * (options['workers'] or os.cpu_count() or 1)
+                result_list, pending = [], deque()
+                for chunk in chunk_list:
+                    pending.append(executor.submit(compute_feature_chunk, [dict(line) for line in chunk]))
+                    if len(pending) >= max_pending:
+                        result_list.append(pending.popleft().result())
+                result_list.extend(future.result() for future in pending)
+        finally:
+            _FEATURE_TASK = None
+    else:
+        raise ValueError('executor should be None, thread or process, not {0}'.format(options['executor']))
+
+    values_and_chunk_errors_list = [([], []) for _ in lines_list]
+    for (match_idx, _), (values, errors) in zip(match_and_chunk_list, result_list):
+        values_and_chunk_errors_list[match_idx][0].extend(values)
+        values_and_chunk_errors_list[match_idx][1].append(errors)
+    return values_and_chunk_errors_list
 
 
 class ChatDataLoader:
 
-    def __init__(self, path: str, label_dict: Dict[str, str]):
+    def __init__(self, path: str, label_dict: Dict[str, str], lazy: bool = False, cache: ChatStoreCache = None,
+                 feature_cache: FeatureCache = None):
         """
         :param path: path of chat file
         :param label_dict: str -> str
@@ -19,64 +118,254 @@ class ChatDataLoader:
                 'country_1': 'BEL',
                 'country_2': 'ENG'
             }
+        :param lazy: parse the chat file on first access, not in __init__
+        :param cache: ChatStoreCache to keep the store in, which may evict it.
+            An evicted store is parsed again with features replayed from feature_recipes,
+            where feature_cache keeps replayed values the same as before (e.g. of non-deterministic ld.detect).
+            Stores edited by ChatLine.__setitem__ are not evicted.
+        :param feature_cache: FeatureCache consulted before computing a feature, and updated after that
 
         Attributes:
-            lines (List[OrderedDict])
-                e.g. [
-                    OrderedDict([
-                        ('time_stamp', '0:00'),
-                        ('author_name', 'NOL OTR'),
-                        ('message', 'Hey FIFA !'),
-                        ...
-                    ]),
-                ]
+            store (ChatStore): columns of lines, and each line is a ChatLine view like
+                OrderedDict([
+                    ('time_stamp', '0:00'),
+                    ('author_name', 'NOL OTR'),
+                    ('message', 'Hey FIFA !'),
+                    ...
+                ])
+            feature_recipes (List[tuple]): (feature_name, feature_func, args, executor_options) added by add_feature
+            feature_version (int): the number of features put, to invalidate what is computed from features
         """
+        self.path = path
         self.label_dict: dict = label_dict
-        self.lines: List[OrderedDict] = list(csv.DictReader(open(path, 'r', encoding='utf-8')))
+        self.cache = cache
+        self.feature_cache = feature_cache
+        self.feature_recipes: List[tuple] = []
+        self.feature_version = 0
+        self._store: ChatStore = None
+
+        if not lazy:
+            _ = self.store
+
+    def __getstate__(self):
+        # Pickle the parsed store instead of the cache, and recipes whose features are in the store.
+        state = self.__dict__.copy()
+        state.update({'_store': self.store, 'cache': None, 'feature_cache': None, 'feature_recipes': []})
+        return state
+
+    @property
+    def store(self) -> ChatStore:
+        store = self.cache.get(self.path) if self.cache is not None else self._store
+        if store is None:
+            store = self.load_store()
+            if self.cache is not None:
+                self.cache.put(self.path, store)
+            else:
+                self._store = store
+        return store
+
+    def load_store(self) -> ChatStore:
+        store = ChatStore.from_csv(self.path)
+        for feature_name, feature_func, args, executor_options in self.feature_recipes:
+            values, chunk_errors = self.compute_feature(
+                [ChatLine(store, i) for i in range(len(store))], feature_name, feature_func, args, executor_options)
+            store.set_column(feature_name, values)
+            self.report_feature_errors(feature_name, chunk_errors)
+        return store
+
+    def is_loaded(self) -> bool:
+        return (self.path in self.cache) if self.cache is not None else (self._store is not None)
 
     def __len__(self):
-        return len(self.lines)
+        return len(self.store)
 
     def __getitem__(self, idx):
-        return self.lines[idx]
+        store = self.store
+        if isinstance(idx, slice):
+            return [ChatLine(store, i) for i in range(*idx.indices(len(store)))]
+        if idx < 0:
+            idx += len(store)
+        if not 0 <= idx < len(store):
+            raise IndexError('line index out of range')
+        return ChatLine(store, idx)
+
+    def __iter__(self):
+        store = self.store
+        return (ChatLine(store, i) for i in range(len(store)))
+
+    @property
+    def lines(self) -> List[ChatLine]:
+        return list(self)
 
     def __str__(self):
         return ' '.join([self.__class__.__name__, str(self.label_dict)])
 
-    def add_feature(self, feature_name: str, feature_func: Callable, args: tuple = tuple()):
+    def add_feature(self, feature_name: str, feature_func: Callable, args: tuple = tuple(),
+                    executor_options: dict = None):
         """
         :param feature_name: str to add
-        :param feature_func: def func(line: OrderedDict, args): ...
+        :param feature_func: def func(line: ChatLine, args): ...
         :param args: tuple
+        :param executor_options: see DEFAULT_EXECUTOR_OPTIONS, e.g. {'executor': 'process', 'workers': 4}
         :return: None
+
+        If the store is not loaded, the feature is computed when it is loaded.
+        """
+        values_and_chunk_errors = None
+        if self.is_loaded():
+            values_and_chunk_errors = self.compute_feature(list(self), feature_name, feature_func, args,
+                                                           executor_options)
+        self.put_feature(feature_name, feature_func, args, executor_options, values_and_chunk_errors)
+
+    def get_feature_key(self, feature_name: str, feature_func: Callable, args: tuple,
+                        executor_options: dict) -> str or None:
+        if self.feature_cache is None:
+            return None
+        batch = dict(DEFAULT_EXECUTOR_OPTIONS, **(executor_options or {}))['batch']
+        return self.feature_cache.get_key(self.path, feature_name, feature_func, args, batch)
+
+    def load_cached_feature(self, feature_name: str, feature_func: Callable, args: tuple,
+                            executor_options: dict) -> tuple or None:
+        """
+        :return: cached (values, errors of each chunk), or None
         """
-        new_lines: List[OrderedDict] = []
-        for line in self.lines:
-            line[feature_name] = feature_func(line, *args)
-            new_lines.append(line)
-        self.lines = new_lines
+        key = self.get_feature_key(feature_name, feature_func, args, executor_options)
+        return self.feature_cache.load(key) if key else None
+
+    def dump_cached_feature(self, feature_name: str, feature_func: Callable, args: tuple,
+                            executor_options: dict, values_and_chunk_errors: tuple):
+        key = self.get_feature_key(feature_name, feature_func, args, executor_options)
+        if key:
+            self.feature_cache.dump(key, values_and_chunk_errors)
+
+    def compute_feature(self, lines: List[ChatLine], feature_name: str, feature_func: Callable, args: tuple,
+                        executor_options: dict) -> tuple:
+        """
+        :return: (values, errors of each chunk), from feature_cache if cached
+        """
+        values_and_chunk_errors = self.load_cached_feature(feature_name, feature_func, args, executor_options)
+        if values_and_chunk_errors is not None:
+            return values_and_chunk_errors
+        [values_and_chunk_errors] = compute_feature_values([lines], feature_func, args, executor_options)
+        self.dump_cached_feature(feature_name, feature_func, args, executor_options, values_and_chunk_errors)
+        return values_and_chunk_errors
+
+    def put_feature(self, feature_name: str, feature_func: Callable, args: tuple, executor_options: dict,
+                    values_and_chunk_errors: tuple = None):
+        """
+        Add the recipe of the feature, and its values if computed.
+        :param values_and_chunk_errors: (values, errors of each chunk) from compute_feature_values
+        """
+        self.feature_recipes.append((feature_name, feature_func, args, executor_options))
+        self.feature_version += 1
+        if values_and_chunk_errors is not None:
+            values, chunk_errors = values_and_chunk_errors
+            self.store.set_column(feature_name, values)
+            self.report_feature_errors(feature_name, chunk_errors)
+            if self.cache is not None:
+                self.cache.update_nbytes(self.path)
         print('Add feature: {}, {}'.format(feature_name, str(self.label_dict)))
 
+    def report_feature_errors(self, feature_name: str, chunk_errors: List[list]):
+        for chunk_idx, errors in enumerate(chunk_errors):
+            if errors:
+                print('P{0} | Error: {1} | {2} | chunk {3}: {4} lines, e.g. {5}'.format(
+                    os.getpid(), feature_name, str(self.label_dict), chunk_idx, len(errors), errors[0],
+                ), file=sys.stderr)
+
     @try_except
     def get_label(self, key):
         return self.label_dict[key]
 
     @try_except
     def get_list_of_keys(self, keys: list):
-        return [[line[k] for k in keys] for line in self.lines]
+        columns = [self.store.columns[k] for k in keys]
+        return [[column[i] for column in columns] for i in range(len(self))]
+
+
+def to_number(s) -> float or None:
+    try:
+        return float(s)
+    except (TypeError, ValueError):
+        return None
+
+
+class LabelIndex:
+
+    def __init__(self, label_dict_list: List[Dict[str, str]]):
+        """
+        Inverted index from labels to positions of label_dict_list.
+        :param label_dict_list: label_dict of each ChatDataLoader
+
+        Attributes:
+            label_to_positions (Dict[tuple, Set[int]]): (label_key, label_value) -> positions
+            key_to_sorted_numbers (Dict[str, tuple]): label_key -> (sorted numeric values, positions of them)
+        """
+        self.size = len(label_dict_list)
+        self.label_to_positions: Dict[tuple, Set[int]] = defaultdict(set)
+        key_to_number_and_positions = defaultdict(list)
+
+        for position, label_dict in enumerate(label_dict_list):
+            for label_key, label_value in label_dict.items():
+                self.label_to_positions[(label_key, label_value)].add(position)
+                number = to_number(label_value)
+                if number is not None:
+                    key_to_number_and_positions[label_key].append((number, position))
+
+        self.key_to_sorted_numbers: Dict[str, tuple] = {}
+        for label_key, number_and_positions in key_to_number_and_positions.items():
+            numbers, positions = zip(*sorted(number_and_positions))
+            self.key_to_sorted_numbers[label_key] = (list(numbers), list(positions))
+
+    def get_positions(self, label_key: str, label_value) -> Set[int]:
+        """
+        :param label_key: e.g. 'winner'
+        :param label_value: e.g. 'DRAW', or (low, high) for a numeric range including both ends.
+            low or high can be None for an open end, e.g. (100, None)
+        """
+        if not isinstance(label_value, tuple):
+            return self.label_to_positions.get((label_key, label_value), set())
+
+        if label_key not in self.key_to_sorted_numbers:
+            return set()
+        numbers, positions = self.key_to_sorted_numbers[label_key]
+        low, high = label_value
+        begin = bisect_left(numbers, low) if low is not None else 0
+        end = bisect_right(numbers, high) if high is not None else len(numbers)
+        return set(positions[begin:end])
+
+    def query(self, target_label_dict: dict) -> List[int]:
+        """
+        :param target_label_dict: e.g. {'winner': 'DRAW', 'ranking_point_diff': (-100, 100)}
+        :return: sorted positions that match every label
+        """
+        if not target_label_dict:
+            return list(range(self.size))
+
+        position_sets = sorted((self.get_positions(k, v) for k, v in target_label_dict.items()), key=len)
+        return sorted(set.intersection(*position_sets))
 
 
 class MultiChatDataLoader:
 
     def __init__(self, path: str, loader_nums: int = None,
-                 label_condition_func: Callable = None, label_condition_args: tuple = tuple()):
+                 label_condition_func: Callable = None, label_condition_args: tuple = tuple(),
+                 lazy: bool = False, memory_budget_in_mb: float = None, feature_cache: FeatureCache = None):
         """
         :param path: path of description file
         :param loader_nums: the number of loaders
         :param label_condition_func: def func(line_dict, *args): ...
         :param label_condition_args: tuple
+        :param lazy: read only the description file here, and parse each chat file on first access
+        :param memory_budget_in_mb: memory budget of parsed chat files if lazy, None for no limit
+        :param feature_cache: FeatureCache of features of each match, None for no cache.
+            FeatureCache() is used if lazy with memory_budget_in_mb, so that features of evicted stores
+            are loaded again instead of recomputed with possibly different values.
         """
         self.chat_data_loader_list: List[ChatDataLoader] = []
+        self.cache = ChatStoreCache(memory_budget_in_mb) if lazy else None
+        if lazy and memory_budget_in_mb and feature_cache is None:
+            feature_cache = FeatureCache()
 
         if label_condition_func:
             line_dict_list = [line_dict for line_dict in csv.DictReader(open(path, 'r', encoding='utf-8'))
@@ -92,30 +381,70 @@ class MultiChatDataLoader:
             self.chat_data_loader_list.append(ChatDataLoader(
                 path=os.path.join(CHAT_PATH, line_dict.pop('file_name')),
                 label_dict=dict(line_dict),
+                lazy=lazy,
+                cache=self.cache,
+                feature_cache=feature_cache,
             ))
 
-    def add_feature(self, feature_name: str, feature_func: Callable, args: tuple = tuple()):
+        self.label_index = LabelIndex([loader.label_dict for loader in self.chat_data_loader_list])
+
+    def add_feature(self, feature_name: str, feature_func: Callable, args: tuple = tuple(),
+                    executor_options: dict = None):
         """
         :param feature_name: str to add
-        :param feature_func: def func(line: OrderedDict, args): ...
+        :param feature_func: def func(line: ChatLine, args): ...
         :param args: tuple
+        :param executor_options: see DEFAULT_EXECUTOR_OPTIONS, e.g. {'executor': 'process', 'workers': 4}
+            Chunks of all loaded matches whose features are not cached are fanned out to one executor
+            and merged back in order.
         :return: None
         """
+        loader_to_values_and_chunk_errors = {}
+        loaded_list = []
+        for _loader in self.chat_data_loader_list:
+            if not _loader.is_loaded():
+                continue
+            values_and_chunk_errors = _loader.load_cached_feature(feature_name, feature_func, args, executor_options)
+            if values_and_chunk_errors is not None:
+                loader_to_values_and_chunk_errors[id(_loader)] = values_and_chunk_errors
+            else:
+                loaded_list.append(_loader)
+
+        values_and_chunk_errors_list = compute_feature_values(
+            [list(_loader) for _loader in loaded_list], feature_func, args, executor_options)
+        for _loader, values_and_chunk_errors in zip(loaded_list, values_and_chunk_errors_list):
+            _loader.dump_cached_feature(feature_name, feature_func, args, executor_options, values_and_chunk_errors)
+            loader_to_values_and_chunk_errors[id(_loader)] = values_and_chunk_errors
+
         for _chat_data_loader in self.chat_data_loader_list:
-            _chat_data_loader.add_feature(feature_name, feature_func, args)
+            _chat_data_loader.put_feature(feature_name, feature_func, args, executor_options,
+                                          loader_to_values_and_chunk_errors.get(id(_chat_data_loader)))
 
     def __len__(self):
         return len(self.chat_data_loader_list)
 
+    def get_data_version(self) -> tuple:
+        """
+        :return: (feature_version, ChatStore.version) of each loader, which changes when a feature is added
+            or a value is set (e.g. line['lang_message'] = 'ko'). Stores are loaded if lazy.
+        """
+        return tuple((_loader.feature_version, _loader.store.version) for _loader in self.chat_data_loader_list)
+
+    def get_label_index(self) -> LabelIndex:
+        # Rebuild if chat_data_loader_list was replaced
+        label_index = getattr(self, 'label_index', None)
+        if label_index is None or label_index.size != len(self.chat_data_loader_list):
+            self.label_index = LabelIndex([loader.label_dict for loader in self.chat_data_loader_list])
+        return self.label_index
+
     def __getitem__(self, target_label_dict: dict) -> List[ChatDataLoader]:
-        r = []
-        for _chat_data_loader in self.chat_data_loader_list:
-            for label_key, label_value in target_label_dict.items():
-                if _chat_data_loader.get_label(label_key) != label_value:
-                    break
-            else:
-                r.append(_chat_data_loader)
-        return r
+        """
+        :param target_label_dict: e.g. {'winner': 'DRAW'}, and (low, high) for a numeric range
+            e.g. {'main': 'KOR', 'ranking_point_diff': (None, 0)}
+        :return: loaders that match every label
+        """
+        return [self.chat_data_loader_list[position]
+                for position in self.get_label_index().query(target_label_dict)]
 
     def __iter__(self):
         self.index = 0
@@ -131,6 +460,6 @@ class MultiChatDataLoader:
 
 if __name__ == '__main__':
     description_files = get_files_with_dir_path(DATA_PATH, 'Description')
-    multi_chat_data_loader = MultiChatDataLoader(path=description_files[0], loader_nums=10)
+    multi_chat_data_loader = MultiChatDataLoader(path=description_files[0], loader_nums=10, lazy=True)
     for chat_data_loader in multi_chat_data_loader:
         print(chat_data_loader)
@@ -0,0 +1,192 @@
+from custom_path import DATA_PATH
+from utill import open_atomic
+from array import array
+from functools import partial
+from typing import Callable
+import hashlib
+import inspect
+import os
+import pickle
+import re
+import sys
+import sysconfig
+import types
+
+# re.Pattern is only in Python >= 3.7.
+Pattern = type(re.compile(''))
+
+# Bump to invalidate every cached feature, e.g. when ChatStore changes how it parses chat files.
+FEATURE_CACHE_VERSION = 2
+
+# Code under these paths is versioned by the version of its package, not by its source.
+LIBRARY_PATHS = tuple(os.path.realpath(sysconfig.get_paths()[k])
+                      for k in ['stdlib', 'platstdlib', 'purelib', 'platlib'])
+
+
+def get_library_version(module_name: str) -> str or None:
+    """
+    :return: e.g. 'langdetect==1.0.7' if module_name is in the standard library or installed packages,
+        None if it is code of this repository
+    """
+    top_module = sys.modules.get((module_name or 'builtins').split('.')[0])
+    file_path = getattr(top_module, '__file__', None)
+    if top_module is not None and file_path and not os.path.realpath(file_path).startswith(LIBRARY_PATHS):
+        return None
+    return '{}=={}'.format(getattr(top_module, '__name__', module_name), getattr(top_module, '__version__', ''))
+
+
+def get_code_version(obj, depth: int = 0, seen: set = None) -> str:
+    """
+    :param obj: feature_func, args, or anything in them
+    :return: str that changes when the code or the arguments of obj change.
+        - Functions of this repository are described by their source (bytecode if the source is not available),
+          __name__, defaults, closure, and functions and classes they refer to as globals.
+        - Bound methods are described by their function and object.
+        - Objects are described by the source of their class and their attributes,
+          except attributes in __version_excluded__ of the class (e.g. LangDetectionCache.key_to_lang).
+        - Functions, classes and modules of libraries are described by the version of the library.
+        - Data objects are described by their values: set and frozenset by sorted items, bytes by repr,
+          regex by (pattern, flags), array (array.array, numpy) by typecode or dtype, shape and hash of data.
+          Other objects of libraries are described by their scalar attributes (e.g. DetectorFactory.seed),
+          or by repr if they have no attributes.
+    """
+    seen = seen if seen is not None else set()
+    if isinstance(obj, (str, int, float, bool, type(None))):
+        return repr(obj)
+    if depth > 12 or id(obj) in seen:
+        return '...'
+    seen.add(id(obj))
+    _version = partial(get_code_version, depth=depth + 1, seen=seen)
+
+    if isinstance(obj, (tuple, list)):
+        return '({})'.format(','.join(_version(o) for o in obj))
+    if isinstance(obj, (set, frozenset)):
+        return '{{{}}}'.format(','.join(sorted(_version(o) for o in obj)))
+    if isinstance(obj, (bytes, bytearray)):
+        return repr(obj)
+    if isinstance(obj, Pattern):
+        return 're({!r},{})'.format(obj.pattern, obj.flags)
+    if isinstance(obj, array) or (hasattr(obj, 'dtype') and hasattr(obj, 'tobytes')):
+        dtype = obj.typecode if isinstance(obj, array) else str(obj.dtype)
+        shape = getattr(obj, 'shape', len(obj))
+        return 'array({},{},{})'.format(dtype, shape, hashlib.sha1(obj.tobytes()).hexdigest())
+    if isinstance(obj, dict):
+        return '{{{}}}'.format(','.join('{}:{}'.format(repr(k), _version(v))
+                                        for k, v in sorted(obj.items(), key=lambda kv: repr(kv[0]))))
+    if isinstance(obj, types.ModuleType):
+        return get_library_version(obj.__name__) or obj.__name__
+    if isinstance(obj, types.MethodType):
+        return 'method[{}|{}]'.format(_version(obj.__func__), _version(obj.__self__))
+
+    is_code = isinstance(obj, (type, types.FunctionType, types.BuiltinFunctionType))
+    library_version = get_library_version(obj.__module__ if is_code else type(obj).__module__)
+    if library_version is not None:
+        if is_code:
+            return '<{} {}>'.format(library_version, obj.__qualname__)
+        if not hasattr(obj, '__dict__'):
+            return '<{} {}|{!r}>'.format(library_version, type(obj).__qualname__, obj)
+        scalar_attrs = {k: v for k, v in vars(obj).items() if isinstance(v, (str, int, float, bool, type(None)))}
+        return '<{} {}|{}>'.format(library_version, type(obj).__qualname__, _version(scalar_attrs))
+
+    if isinstance(obj, types.FunctionType):
+        code = obj.__code__
+        try:
+            source = inspect.getsource(obj)
+        except (OSError, TypeError):
+            source = code.co_code.hex() + repr(code.co_consts)
+        closure = [cell.cell_contents for cell in (obj.__closure__ or [])]
+        global_names = sorted(name for name in get_code_names(code) if name in obj.__globals__)
+        referred = [obj.__globals__[name] for name in global_names
+                    if isinstance(obj.__globals__[name], (type, types.FunctionType, types.ModuleType))]
+        return '{}[{}|{}|{}|{}]'.format(obj.__name__, source, _version(obj.__defaults__), _version(closure),
+                                        _version(referred))
+
+    if isinstance(obj, type):
+        try:
+            return inspect.getsource(obj)
+        except (OSError, TypeError):
+            return obj.__qualname__
+
+    excluded = getattr(type(obj), '__version_excluded__', tuple())
+    attrs = {k: v for k, v in getattr(obj, '__dict__', {}).items() if k not in excluded}
+    return '<{}|{}>'.format(_version(type(obj)), _version(attrs))
+
+
+def get_code_names(code: types.CodeType) -> set:
+    # Global names of code and of nested functions (e.g. comprehensions).
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= get_code_names(const)
+    return names
+
+
+class FeatureCache:
+
+    def __init__(self, path: str = None):
+        """
+        Per-match cache of feature values in a directory, replacing a pickle of the whole MultiChatDataLoader.
+        The key of a feature is the hash of
+            (FEATURE_CACHE_VERSION, content of the chat file, feature_name, code version of feature_func and args),
+        so only the features of changed chat files or changed code are recomputed,
+        and only the matches that are selected (e.g. by label_condition_func) are read.
+        :param path: directory of .pkl files, DATA_PATH/FeatureCache by default
+        """
+        self.path = path or os.path.join(DATA_PATH, 'FeatureCache')
+        self.file_stat_to_hash = {}
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def get_file_hash(self, file_path: str) -> str:
+        # Hash each file once while its size and mtime are the same.
+        stat = os.stat(file_path)
+        stat_key = (file_path, stat.st_size, stat.st_mtime_ns)
+        if stat_key not in self.file_stat_to_hash:
+            sha1 = hashlib.sha1()
+            with open(file_path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    sha1.update(block)
+            self.file_stat_to_hash[stat_key] = sha1.hexdigest()
+        return self.file_stat_to_hash[stat_key]
+
+    def get_key(self, file_path: str, feature_name: str, feature_func: Callable, args: tuple,
+                batch: bool = False) -> str:
+        feature_version = '|'.join([
+            str(FEATURE_CACHE_VERSION),
+            feature_name,
+            str(batch),
+            get_code_version(feature_func),
+            get_code_version(args),
+        ])
+        return '{}-{}-{}'.format(
+            os.path.splitext(os.path.basename(file_path))[0][:40],
+            feature_name,
+            hashlib.sha1((self.get_file_hash(file_path) + feature_version).encode('utf-8')).hexdigest(),
+        )
+
+    def get_file_path(self, key: str) -> str:
+        return os.path.join(self.path, '{}.pkl'.format(key))
+
+    def load(self, key: str) -> tuple or None:
+        """
+        :return: cached (values, errors of each chunk) of the key, or None
+            Errors are cached with values, so that lines whose feature failed are reported again.
+        """
+        try:
+            with open(self.get_file_path(key), 'rb') as f:
+                values_and_chunk_errors = pickle.load(f)
+            self.hits += 1
+            return values_and_chunk_errors
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+
+    def dump(self, key: str, values_and_chunk_errors: tuple):
+        with open_atomic(self.get_file_path(key), 'wb') as f:
+            pickle.dump(tuple(values_and_chunk_errors), f)
+
+    def get_stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,125 @@
+from custom_path import DATA_PATH
+from LangDetector import BatchLangDetector, CachedBatchLangDetector
+from utill import open_atomic
+from collections import OrderedDict
+from typing import Callable, List
+import os
+import pickle
+
+
+class LangDetectionCache:
+    # Cached languages and counters do not change what is detected, so they are not in the key of FeatureCache.
+    __version_excluded__ = ('path', 'max_size', 'key_to_lang', 'hits', 'misses')
+
+    def __init__(self, path: str = None, max_size: int = 2000000):
+        """
+        Persistent memo of detected languages keyed by (detector name, normalized text),
+        shared by runs and by detectors. The least recently used keys are evicted over max_size.
+        :param path: path of .pkl file, DATA_PATH/LangDetectionCache.pkl by default
+        :param max_size: max number of keys
+
+        With 'process' executor of add_feature, workers use a copy of the cache and their new keys are lost.
+        """
+        self.path = path or os.path.join(DATA_PATH, 'LangDetectionCache.pkl')
+        self.max_size = max_size
+        self.key_to_lang: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        if os.path.isfile(self.path):
+            with open(self.path, 'rb') as f:
+                self.key_to_lang = pickle.load(f)
+
+    def __len__(self):
+        return len(self.key_to_lang)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return ' '.join(text.split()).casefold()
+
+    @staticmethod
+    def get_detector_name(lang_func: Callable or BatchLangDetector) -> str:
+        return '.'.join([str(getattr(lang_func, '__module__', None)), lang_func.__name__])
+
+    def detect(self, detector_name: str, lang_func: Callable, text: str) -> str:
+        """
+        :return: cached language of text, or lang_func(text) if it is not cached.
+            Exceptions of lang_func are not cached.
+        """
+        key = (detector_name, self.normalize(text))
+        lang = self.key_to_lang.get(key)
+        if lang is not None:
+            self.hits += 1
+            self.key_to_lang.move_to_end(key)
+            return lang
+
+        self.misses += 1
+        lang = lang_func(text)
+        self.put(key, lang)
+        return lang
+
+    def detect_batch(self, detector_name: str, detect_batch_func: Callable, texts: List[str]) -> List[str]:
+        """
+        :param detect_batch_func: def func(texts: List[str]) -> List[str]
+        :return: languages of texts, where only texts not cached are passed to detect_batch_func at once.
+            None (not detected) is not cached.
+        """
+        keys = [(detector_name, self.normalize(text)) for text in texts]
+        r = [self.key_to_lang.get(key) for key in keys]
+
+        # Detect each missed key once.
+        missed_key_to_text = OrderedDict()
+        for key, text, lang in zip(keys, texts, r):
+            if lang is None:
+                missed_key_to_text.setdefault(key, text)
+            else:
+                self.key_to_lang.move_to_end(key)
+        self.hits += len(texts) - len(missed_key_to_text)
+        self.misses += len(missed_key_to_text)
+
+        if missed_key_to_text:
+            missed_key_to_lang = dict(zip(missed_key_to_text.keys(),
+                                          detect_batch_func(list(missed_key_to_text.values()))))
+            for key, lang in missed_key_to_lang.items():
+                if lang is not None:
+                    self.put(key, lang)
+            r = [(lang if lang is not None else missed_key_to_lang[key]) for key, lang in zip(keys, r)]
+        return r
+
+    def put(self, key: tuple, lang: str):
+        self.key_to_lang[key] = lang
+        self.key_to_lang.move_to_end(key)
+        while len(self.key_to_lang) > self.max_size:
+            self.key_to_lang.popitem(last=False)
+
+    def wrap(self, lang_func: Callable) -> Callable:
+        """
+        :return: lang_func that consults this cache, with the same __name__
+        """
+        detector_name = self.get_detector_name(lang_func)
+
+        def wrapper(text: str) -> str:
+            return self.detect(detector_name, lang_func, text)
+
+        wrapper.__name__ = lang_func.__name__
+        return wrapper
+
+    def wrap_batch(self, detector: BatchLangDetector) -> BatchLangDetector:
+        """
+        :return: BatchLangDetector that consults this cache, with the same __name__
+        """
+        return CachedBatchLangDetector(self, detector, self.get_detector_name(detector))
+
+    def get_stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0,
+        }
+
+    def dump(self):
+        with open_atomic(self.path, 'wb') as f:
+            pickle.dump(self.key_to_lang, f)
+        print('Dumped: {}, {}'.format(os.path.basename(self.path), self.get_stats()))
@@ -0,0 +1,126 @@
+from custom_path import FASTTEXT_VEC_PATH
+from typing import Callable, List
+import os
+
+# https://github.com/Mimino666/langdetect
+import langdetect as ld
+from langdetect.detector_factory import DetectorFactory, init_factory
+from langdetect.lang_detect_exception import LangDetectException
+
+
+def is_trivial_text(s: str, min_token_length: int) -> bool:
+    """
+    :return: True if s has no letters (e.g. emoji, digits, punctuation),
+        or is a single token shorter than min_token_length (e.g. 'gg', 'ok')
+    """
+    if not any(ch.isalpha() for ch in s):
+        return True
+    tokens = s.split()
+    return len(tokens) == 1 and len(tokens[0]) < min_token_length
+
+
+def deterministic_detect(seed: int = 0, min_token_length: int = 4) -> Callable[[str], str]:
+    """
+    :param seed: seed of every langdetect Detector, which makes results reproducible
+    :param min_token_length: single tokens shorter than this are not detected
+    :return: lang_func that returns '' for trivial texts and texts without features,
+        with the profiles of langdetect loaded once per process
+    """
+    init_factory()
+    factory: DetectorFactory = ld.detector_factory._factory
+    factory.seed = seed
+
+    def wrapper(s: str) -> str:
+        if is_trivial_text(s, min_token_length):
+            return ''
+        detector = factory.create()
+        detector.append(s)
+        try:
+            return detector.detect()
+        except LangDetectException:
+            return ''
+
+    # set the __name__ of wrapper
+    w = wrapper
+    w.__name__ = 'deterministic_detect_{}_{}'.format(seed, min_token_length)
+
+    return w
+
+
+class BatchLangDetector:
+
+    def __init__(self, name: str):
+        """
+        Detect languages of a list of str in one call.
+        :param name: name of the detector, used as __name__ of lang_func (e.g. in MultiLangChatDataLoader.info)
+        """
+        self.__name__ = name
+
+    def detect_batch(self, texts: List[str]) -> List[str]:
+        """
+        :param texts: list of str
+        :return: list of language (e.g. 'en'), None for a text that cannot be detected
+        """
+        raise NotImplementedError
+
+
+class FuncBatchLangDetector(BatchLangDetector):
+
+    def __init__(self, lang_func: Callable):
+        """
+        Batch interface of one-at-a-time lang_func, e.g. ld.detect, li_classify_str
+        """
+        super().__init__(lang_func.__name__)
+        self.lang_func = lang_func
+
+    def detect_batch(self, texts: List[str]) -> List[str]:
+        r = []
+        for text in texts:
+            try:
+                r.append(self.lang_func(text))
+            except Exception:
+                r.append(None)
+        return r
+
+
+class FastTextLangDetector(BatchLangDetector):
+    # The loaded model is described by model_path in the key of FeatureCache.
+    __version_excluded__ = ('model',)
+
+    def __init__(self, model_path: str = None):
+        """
+        fastText language identification, which predicts a whole list in one call.
+        :param model_path: path of lid.176.bin (or .ftz), FASTTEXT_VEC_PATH/lid.176.bin by default
+            https://fasttext.cc/docs/en/language-identification.html
+        """
+        super().__init__('fasttext_lid')
+
+        # https://github.com/facebookresearch/fastText/tree/master/python
+        import fasttext
+        self.model_path = model_path or os.path.join(FASTTEXT_VEC_PATH, 'lid.176.bin')
+        self.model = fasttext.load_model(self.model_path)
+
+    def detect_batch(self, texts: List[str]) -> List[str]:
+        # fastText predicts one line per text, so newlines are removed.
+        predicted = self.model.predict([' '.join(text.split()) for text in texts], k=1)
+
+        # (labels, probabilities) in fasttext >= 0.9, and labels in older versions.
+        labels_list = predicted[0] if isinstance(predicted, tuple) else predicted
+        return [(labels[0].replace('__label__', '') if labels else None) for labels in labels_list]
+
+
+class CachedBatchLangDetector(BatchLangDetector):
+
+    def __init__(self, lang_cache, detector: BatchLangDetector, detector_name: str):
+        """
+        :param lang_cache: LangDetectionCache consulted before detector
+        :param detector: BatchLangDetector that detects only texts not in lang_cache
+        :param detector_name: name of the detector in lang_cache
+        """
+        super().__init__(detector.__name__)
+        self.lang_cache = lang_cache
+        self.detector = detector
+        self.detector_name = detector_name
+
+    def detect_batch(self, texts: List[str]) -> List[str]:
+        return self.lang_cache.detect_batch(self.detector_name, self.detector.detect_batch, texts)
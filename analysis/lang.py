@@ -1,15 +1,22 @@
 from custom_path import DATA_PATH
+from ChatStore import ChatStore, EncodedColumn
 from DataLoader import MultiChatDataLoader
-from utill import get_files_with_dir_path, try_except, have_enough_words, iso2sec
+from FeatureCache import FeatureCache
+from LangCache import LangDetectionCache
+from LangDetector import BatchLangDetector, deterministic_detect
+from utill import get_files_with_dir_path, have_enough_words, open_atomic
 from WriterWrapper import WriterWrapper
-from typing import Callable, Tuple, Dict
+from typing import Callable, Tuple, Dict, List
 from collections import OrderedDict
-from termcolor import cprint, colored
 from collections import Counter, defaultdict
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from multiprocessing import Pool
+import hashlib
+import json
 import os
-import pickle
 import matplotlib.pyplot as plt
-import itertools
+import numpy as np
 
 # https://github.com/Mimino666/langdetect
 import langdetect as ld
@@ -18,7 +25,6 @@ import langdetect as ld
 import langid as li
 
 
-@try_except
 def detect_func(line_dict: OrderedDict, criteria_func: Callable, langdetect_func: Callable, line_key: str):
     if criteria_func(line_dict[line_key]):
         return langdetect_func(line_dict[line_key])
@@ -26,6 +32,106 @@ def detect_func(line_dict: OrderedDict, criteria_func: Callable, langdetect_func
         return ''
 
 
+def detect_batch_func(lines: list, criteria_func: Callable, batch_detector: BatchLangDetector, line_key: str) -> list:
+    """
+    :return: languages of line[line_key] of lines detected in one call, '' for lines that do not meet criteria_func
+    """
+    texts = [line[line_key] for line in lines]
+    criteria_idx_list = [i for i, text in enumerate(texts) if criteria_func(text)]
+    r = [''] * len(texts)
+    for i, lang in zip(criteria_idx_list, batch_detector.detect_batch([texts[i] for i in criteria_idx_list])):
+        r[i] = lang
+    return r
+
+
+def count_by_time_bin(store: ChatStore, key: str, bin_width_in_sec: int = 60) -> dict:
+    """
+    :param store: ChatStore whose time_stamp_secs are parsed
+    :param key: e.g. 'lang_message'
+    :param bin_width_in_sec: e.g. 10, 60, 300
+    :return: {
+            'time_bin': start sec of each bin from 0 to the last line, e.g. array([0, 60, 120, ...]),
+            'langs': values of key sorted by the number of lines, except '' and None,
+            'counts': array of shape (bins, langs), the number of lines of each lang in each bin,
+        }
+        where lines without time_stamp (e.g. before the video starts) are not counted.
+    """
+    column = store.columns[key]
+    if not isinstance(column, EncodedColumn):
+        column = EncodedColumn(column)
+
+    secs = np.array(store.time_stamp_secs, dtype=np.int64)
+    codes = np.array(column.codes, dtype=np.int64)
+    is_lang_of_code = np.array([bool(v) for v in column.values], dtype=bool)
+    valid = (secs >= 0) & is_lang_of_code[codes]
+
+    num_of_codes = len(column.values)
+    bins = secs[valid] // bin_width_in_sec
+    num_of_bins = int(bins.max()) + 1 if len(bins) else 0
+    counts = np.bincount(bins * num_of_codes + codes[valid],
+                         minlength=num_of_bins * num_of_codes).reshape(num_of_bins, num_of_codes)
+
+    # Drop '' and unused codes, then sort languages by the number of lines.
+    totals = counts.sum(axis=0)
+    code_order = [code for code in np.argsort(-totals, kind='mergesort') if totals[code] > 0]
+    return {
+        'time_bin': np.arange(num_of_bins) * bin_width_in_sec,
+        'langs': [column.values[code] for code in code_order],
+        'counts': counts[:, code_order],
+    }
+
+
+def get_plot_kwargs_list(series: dict, with_en: bool = True, num_of_plots: int = None) -> List[dict]:
+    """
+    :param series: count_by_time_bin of a match
+    :return: kwargs of plot() of each language, sorted by the number of lines
+    """
+    plt_kwargs_list = []
+    for lang_idx, label in enumerate(series['langs']):
+        plt_kwargs_list.append({
+            'x': series['time_bin'] / 60,
+            'y': series['counts'][:, lang_idx],
+            'label': label,
+        })
+
+    if not with_en:
+        plt_kwargs_list = [kw for kw in plt_kwargs_list if kw['label'] != 'en']
+
+    if num_of_plots:
+        plt_kwargs_list = plt_kwargs_list[:num_of_plots]
+    return plt_kwargs_list
+
+
+def get_plot_digest(title: str, plt_kwargs_list: List[dict]) -> str:
+    sha1 = hashlib.sha1(title.encode('utf-8'))
+    for plt_kwargs in plt_kwargs_list:
+        sha1.update(plt_kwargs['label'].encode('utf-8'))
+        sha1.update(np.ascontiguousarray(plt_kwargs['x'], dtype=np.float64).tobytes())
+        sha1.update(np.ascontiguousarray(plt_kwargs['y'], dtype=np.int64).tobytes())
+    return sha1.hexdigest()
+
+
+def render_plot(task: tuple) -> str:
+    """
+    Render a figure with the Agg canvas, without pyplot, so that processes can render in parallel.
+    :param task: (png_path, title, plt_kwargs_list)
+    :return: png_path
+    """
+    png_path, title, plt_kwargs_list = task
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1, 1, 1)
+    plots = [ax.plot(kw['x'], kw['y'], label=kw['label'])[0] for kw in plt_kwargs_list]
+    ax.set_xlabel('min')
+    ax.set_title(title)
+    if plots:
+        ax.legend(handles=plots)
+
+    with open_atomic(png_path, 'wb') as f:
+        fig.savefig(f, format='png')
+    return png_path
+
+
 def li_classify_str(s):
     return li.classify(s)[0]
 
@@ -35,14 +141,20 @@ class MultiLangChatDataLoader(MultiChatDataLoader):
     def __init__(self, path: str, loader_nums: int = None,
                  label_condition_func: Callable = None, label_condition_args: tuple = tuple(),
                  criteria_funcs: Tuple[Callable, Callable] = (None, None),
-                 lang_func: Callable = ld.detect):
+                 lang_func: Callable = ld.detect, lang_cache: LangDetectionCache = None,
+                 lazy: bool = False, memory_budget_in_mb: float = None, feature_cache: FeatureCache = None):
         """
         :param path: path of description file
         :param loader_nums: the number of loaders
         :param label_condition_func: def func(line_dict, *args): ... like is_values_of_key_matched
         :param label_condition_args: e.g. ({'winner': 'DRAW', 'main': 'ISL'},)
         :param criteria_funcs: tuple of criteria_func for feature addition
-        :param lang_func: return str
+        :param lang_func: return str, or BatchLangDetector (e.g. FastTextLangDetector) that detects a whole match at once
+        :param lang_cache: cache consulted before lang_func, LangDetectionCache() by default
+        :param lazy: parse each chat file and add its features on first access
+        :param memory_budget_in_mb: memory budget of parsed chat files if lazy, None for no limit
+        :param feature_cache: per-match cache of detected languages, FeatureCache() by default.
+            It is invalidated by changes of chat files, criteria_funcs and lang_func.
         """
 
         self.info = '-'.join([
@@ -53,53 +165,45 @@ class MultiLangChatDataLoader(MultiChatDataLoader):
             str(lang_func.__name__),
         ])
 
-        if self.load():
-            return
-
         super().__init__(
             path=path,
             loader_nums=loader_nums,
             label_condition_func=label_condition_func,
             label_condition_args=label_condition_args,
+            lazy=lazy,
+            memory_budget_in_mb=memory_budget_in_mb,
+            feature_cache=feature_cache or FeatureCache(),
         )
 
+        self.lang_cache = lang_cache or LangDetectionCache()
+        self.stats: dict = None
+        self.stats_data_version: tuple = None
+
         # Add detected language.
         # args = (criteria_func: Callable, lang_func: Callable, line_key: str)
         criteria_func_list = [(cf if cf else lambda _: True) for cf in criteria_funcs]
-        self.add_feature('lang_author_name', detect_func,
-                         args=(criteria_func_list.pop(0), lang_func, 'author_name'))
-        self.add_feature('lang_message', detect_func,
-                         args=(criteria_func_list.pop(0), lang_func, 'message'))
-
-    def get_file_name_to_dump_and_load(self):
-        return '{}-{}.pkl'.format(self.__class__.__name__, self.info)
-
-    def dump(self):
-        dump_file_name = self.get_file_name_to_dump_and_load()
-
-        # If dump_file_name exists, just return.
-        if dump_file_name in os.listdir(DATA_PATH):
-            cprint('Dump Fail: {} already exists.'.format(dump_file_name), 'red')
-            return
-
-        with open(os.path.join(DATA_PATH, dump_file_name), 'wb') as f:
-            pickle.dump(self, f)
-        cprint('Dumped: {}'.format(dump_file_name), 'blue')
-
-    def load(self):
-        load_file_name = self.get_file_name_to_dump_and_load()
-        try:
-            with open(os.path.join(DATA_PATH, load_file_name), 'rb') as f:
-                loaded: MultiLangChatDataLoader = pickle.load(f)
-                self.chat_data_loader_list = loaded.chat_data_loader_list
-            cprint('Loaded: {}'.format(load_file_name), 'green')
-            return True
-        except Exception as e:
-            print(colored('Load Fail: {0}.\n'.format(load_file_name), 'red'), str(e))
-            return False
-
-    def is_dump_possible(self):
-        return self.get_file_name_to_dump_and_load() not in os.listdir(DATA_PATH)
+        if isinstance(lang_func, BatchLangDetector):
+            cached_batch_detector = self.lang_cache.wrap_batch(lang_func)
+            batch_options = {'batch': True, 'chunk_size': None}
+            self.add_feature('lang_author_name', detect_batch_func,
+                             args=(criteria_func_list.pop(0), cached_batch_detector, 'author_name'),
+                             executor_options=batch_options)
+            self.add_feature('lang_message', detect_batch_func,
+                             args=(criteria_func_list.pop(0), cached_batch_detector, 'message'),
+                             executor_options=batch_options)
+        else:
+            cached_lang_func = self.lang_cache.wrap(lang_func)
+            self.add_feature('lang_author_name', detect_func,
+                             args=(criteria_func_list.pop(0), cached_lang_func, 'author_name'))
+            self.add_feature('lang_message', detect_func,
+                             args=(criteria_func_list.pop(0), cached_lang_func, 'message'))
+        self.lang_cache.dump()
+
+    def __getstate__(self):
+        # lang_cache is persisted by itself.
+        state = self.__dict__.copy()
+        state['lang_cache'] = None
+        return state
 
     def get_lang_list(self) -> Dict[str, list]:
         lang_key_to_counter = defaultdict(lambda: Counter())
@@ -114,18 +218,28 @@ class MultiLangChatDataLoader(MultiChatDataLoader):
             )] + ['']
         return lang_key_to_list
 
-    def get_stats(self):
-        author_lang_dict = defaultdict(list)
-        message_lang_dict = defaultdict(list)
+    def get_stats(self) -> Dict[str, Dict[tuple, Counter]]:
+        """
+        :return: {'author_lang': {(country_1, country_2): Counter of languages}, 'message_lang': {...}},
+            where '' (not detected) is counted as None.
+            It is computed in one pass over language columns, and memoized until features or values change.
+        """
+        data_version = self.get_data_version()
+        if self.stats is None or self.stats_data_version != data_version:
+            self.stats = self.count_langs()
+            self.stats_data_version = data_version
+        return self.stats
+
+    def count_langs(self) -> Dict[str, Dict[tuple, Counter]]:
+        stats = {'author_lang': defaultdict(Counter), 'message_lang': defaultdict(Counter)}
         for data_loader in self:
             match_tuple = (data_loader.get_label('country_1'), data_loader.get_label('country_2'))
-            author_lang_dict[match_tuple] += [line_dict['lang_author_name'] for line_dict in data_loader]
-            message_lang_dict[match_tuple] += [line_dict['lang_message'] for line_dict in data_loader]
-
-        return {
-            'author_lang': {k: Counter([(vv if vv else None) for vv in v]) for k, v in author_lang_dict.items()},
-            'message_lang': {k: Counter([(vv if vv else None) for vv in v]) for k, v in message_lang_dict.items()},
-        }
+            store = data_loader.store
+            for name, key in [('author_lang', 'lang_author_name'), ('message_lang', 'lang_message')]:
+                counter = stats[name][match_tuple]
+                for lang, count in store.count_column(key).items():
+                    counter[lang if lang else None] += count
+        return {name: dict(match_to_counter) for name, match_to_counter in stats.items()}
 
     def export_stats(self):
         stats = self.get_stats()
@@ -142,8 +256,12 @@ class MultiLangChatDataLoader(MultiChatDataLoader):
                 writer.write_row(line_dict)
             writer.close()
 
-    def get_match_to_series(self):
-        match_to_series = defaultdict(lambda: defaultdict(list))
+    def get_match_to_series(self, bin_width_in_sec: int = 60) -> Dict[tuple, dict]:
+        """
+        :param bin_width_in_sec: e.g. 10, 60, 300
+        :return: (country_1, country_2, main, first author_name) -> count_by_time_bin of lang_message
+        """
+        match_to_series = OrderedDict()
         for data_loader in self:
             match_tuple = (
                 data_loader.get_label('country_1'),
@@ -151,69 +269,97 @@ class MultiLangChatDataLoader(MultiChatDataLoader):
                 data_loader.get_label('main'),
                 data_loader[0]['author_name'],
             )
-            time_bin_to_lang_list = defaultdict(list)
-            for line_dict in data_loader:
-                lang_message = line_dict['lang_message']
-                time_stamp_sec = iso2sec(line_dict['time_stamp'])
-                if lang_message:
-                    time_bin_to_lang_list[int(time_stamp_sec % 60)].append(lang_message)
-            total_lang_list = list(set(itertools.chain(*time_bin_to_lang_list.values())))
-            time_bin_to_lang_counter = {
-                time_bin: Counter(lang_list) for time_bin, lang_list in time_bin_to_lang_list.items()
-            }
-            for time_bin, lang_counter in sorted(time_bin_to_lang_counter.items(), key=lambda x: x[0]):
-                match_to_series[match_tuple]['time_bin'].append(time_bin)
-                for lang in total_lang_list:
-                    match_to_series[match_tuple][lang].append(lang_counter[lang] if lang in lang_counter else 0)
+            match_to_series[match_tuple] = count_by_time_bin(data_loader.store, 'lang_message', bin_width_in_sec)
         return match_to_series
 
+    def export_match_to_series(self, bin_width_in_sec: int = 60):
+        match_to_series = self.get_match_to_series(bin_width_in_sec)
+        total_counter = Counter()
+        for series in match_to_series.values():
+            total_counter.update(dict(zip(series['langs'], series['counts'].sum(axis=0).tolist())))
+        fieldnames = ['match', 'time_bin'] + [lang for lang, _ in total_counter.most_common()]
+
+        writer = WriterWrapper(os.path.join(DATA_PATH, 'lang_series_{}s'.format(bin_width_in_sec)), fieldnames)
+        for match, series in match_to_series.items():
+            match_name = '_'.join(match[:-1])
+            for time_bin, row in zip(series['time_bin'].tolist(), series['counts'].tolist()):
+                writer.write_row({'match': match_name, 'time_bin': time_bin, **dict(zip(series['langs'], row))})
+        writer.close()
+
     def plot_match_to_series(self, options=None):
         # https://matplotlib.org/users/pyplot_tutorial.html
         options = options if options else {}
         num_of_plots = None if 'num_of_plots' not in options else options['num_of_plots']
         with_en = True if 'with_en' not in options else options['with_en']
         show_or_save = 'show' if 'show_or_save' not in options else options['show_or_save']
+        bin_width_in_sec = 60 if 'bin_width_in_sec' not in options else options['bin_width_in_sec']
 
-        match_to_series = self.get_match_to_series()
-        for match, series in match_to_series.items():
-
-            plt_kwargs_list = []
-            for label, values in sorted(series.items(), key=lambda kv: -sum(kv[1])):
-                if label == 'time_bin':
-                    continue
-                plt_kwargs_list.append({
-                    'x': series['time_bin'],
-                    'y': values,
-                    'label': label,
-                })
-
-            if not with_en:
-                plt_kwargs_list = [kw for kw in plt_kwargs_list if kw['label'] != 'en']
-
-            if num_of_plots:
-                plt_kwargs_list = plt_kwargs_list[:num_of_plots]
+        if show_or_save != 'show':
+            self.save_match_to_series_plots(options)
+            return
 
+        match_to_series = self.get_match_to_series(bin_width_in_sec)
+        for match, series in match_to_series.items():
             plots = []
-            for plt_kwargs in plt_kwargs_list:
+            for plt_kwargs in get_plot_kwargs_list(series, with_en, num_of_plots):
                 _plot = plt.plot(plt_kwargs['x'], plt_kwargs['y'], label=plt_kwargs['label'])
                 plots.append(_plot[0])
 
             plt.xlabel('min')
             plt.title('_'.join(match[:-1]))
             plt.legend(handles=plots)
-
-            if show_or_save == 'show':
-                plt.show()
-            else:
-                plots_path = '../data/plots/{}'.format(self.info)
-                if not os.path.isdir(plots_path):
-                    os.mkdir(plots_path)
-                plt.savefig('{}/{}.png'.format(plots_path, '_'.join(match[:-1])))
+            plt.show()
 
             plt.clf()
             plt.cla()
             plt.close()
 
+    def save_match_to_series_plots(self, options=None) -> List[str]:
+        """
+        Render png of each match to ../data/plots/<info> in a process pool with the Agg backend.
+        Matches whose series and options are the same as the last run, by digest.json in the directory, are skipped.
+        :param options: options of plot_match_to_series, and 'processes' (None for the number of CPUs)
+        :return: paths of rendered png
+        """
+        options = options if options else {}
+        num_of_plots = None if 'num_of_plots' not in options else options['num_of_plots']
+        with_en = True if 'with_en' not in options else options['with_en']
+        bin_width_in_sec = 60 if 'bin_width_in_sec' not in options else options['bin_width_in_sec']
+        processes = None if 'processes' not in options else options['processes']
+
+        plots_path = '../data/plots/{}'.format(self.info)
+        if not os.path.isdir(plots_path):
+            os.makedirs(plots_path)
+        digest_path = os.path.join(plots_path, 'digest.json')
+        png_name_to_digest = {}
+        if os.path.isfile(digest_path):
+            with open(digest_path, 'r', encoding='utf-8') as f:
+                png_name_to_digest = json.load(f)
+
+        tasks = []
+        new_png_name_to_digest = {}
+        for match, series in self.get_match_to_series(bin_width_in_sec).items():
+            title = '_'.join(match[:-1])
+            png_name = '{}.png'.format(title)
+            plt_kwargs_list = get_plot_kwargs_list(series, with_en, num_of_plots)
+            digest = get_plot_digest(title, plt_kwargs_list)
+            new_png_name_to_digest[png_name] = digest
+            if png_name_to_digest.get(png_name) == digest and os.path.isfile(os.path.join(plots_path, png_name)):
+                continue
+            tasks.append((os.path.join(plots_path, png_name), title, plt_kwargs_list))
+
+        if len(tasks) > 1 and processes != 1:
+            with Pool(processes) as pool:
+                rendered = list(pool.imap_unordered(render_plot, tasks))
+        else:
+            rendered = [render_plot(task) for task in tasks]
+
+        with open_atomic(digest_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(png_name_to_digest, **new_png_name_to_digest), f, indent=2, sort_keys=True)
+        print('Plots: {} rendered, {} up to date, in {}'.format(
+            len(rendered), len(new_png_name_to_digest) - len(rendered), plots_path))
+        return rendered
+
 
 if __name__ == '__main__':
 
@@ -223,18 +369,16 @@ if __name__ == '__main__':
         label_condition_func=None,
         label_condition_args=tuple(),
         criteria_funcs=(have_enough_words(1), have_enough_words(1)),
-        lang_func=ld.detect,
+        lang_func=deterministic_detect(seed=0, min_token_length=4),
     )
 
-    if multi_lang_chat_data_loader.is_dump_possible():
-        multi_lang_chat_data_loader.dump()
-
     MODE = 'STATS'
     if MODE == 'PLOT':
         multi_lang_chat_data_loader.plot_match_to_series({
             'num_of_plots': 3,
             'with_en': True,
             'show_or_save': 'save',
+            'bin_width_in_sec': 60,
         })
     elif MODE == 'STATS':
         multi_lang_chat_data_loader.export_stats()
@@ -0,0 +1,79 @@
+from custom_path import DATA_PATH
+from DataLoader import MultiChatDataLoader
+from LangDetector import BatchLangDetector, FuncBatchLangDetector, FastTextLangDetector
+from lang import li_classify_str
+from utill import get_files_with_dir_path, get_tsv, have_enough_words
+from typing import Dict, List
+from itertools import combinations
+from time import time
+import os
+
+# https://github.com/Mimino666/langdetect
+import langdetect as ld
+
+
+def get_sample_texts(description_path: str, loader_nums: int, line_key: str = 'message') -> List[str]:
+    criteria_func = have_enough_words(1)
+    multi_chat_data_loader = MultiChatDataLoader(path=description_path, loader_nums=loader_nums, lazy=True)
+    texts = []
+    for chat_data_loader in multi_chat_data_loader:
+        texts += [line[line_key] for line in chat_data_loader if line[line_key] and criteria_func(line[line_key])]
+    return texts
+
+
+def compare_detectors(detectors: List[BatchLangDetector], texts: List[str], gold_langs: List[str] = None) -> dict:
+    """
+    :param detectors: detectors to compare
+    :param texts: texts to detect
+    :param gold_langs: correct language of each text if exists
+    :return: {
+        'throughput': {detector: texts per sec},
+        'accuracy': {detector: ratio of texts whose language is gold_langs} (only if gold_langs),
+        'agreement': {(detector, detector): ratio of texts detected as the same language},
+    }
+    """
+    name_to_langs: Dict[str, list] = {}
+    r = {'throughput': {}, 'accuracy': {}, 'agreement': {}}
+
+    for detector in detectors:
+        start_time = time()
+        name_to_langs[detector.__name__] = detector.detect_batch(texts)
+        r['throughput'][detector.__name__] = len(texts) / (time() - start_time)
+
+        if gold_langs:
+            langs = name_to_langs[detector.__name__]
+            r['accuracy'][detector.__name__] = sum(l == g for l, g in zip(langs, gold_langs)) / len(gold_langs)
+
+    for name_1, name_2 in combinations(name_to_langs.keys(), 2):
+        pairs = list(zip(name_to_langs[name_1], name_to_langs[name_2]))
+        r['agreement'][(name_1, name_2)] = sum(l1 == l2 for l1, l2 in pairs) / len(pairs) if pairs else 0
+
+    return r
+
+
+if __name__ == '__main__':
+
+    # Labeled chats (text \t iso639-1 code) for accuracy, if they exist.
+    gold_path = os.path.join(DATA_PATH, 'lang_gold.tsv')
+    if os.path.isfile(gold_path):
+        gold_texts, gold_langs = zip(*[line for line in get_tsv(gold_path) if len(line) == 2])
+        sample_texts, sample_gold_langs = list(gold_texts), list(gold_langs)
+    else:
+        description_files = get_files_with_dir_path(DATA_PATH, 'Description')
+        sample_texts, sample_gold_langs = get_sample_texts(description_files[0], loader_nums=5), None
+
+    ld.DetectorFactory.seed = 0
+    result = compare_detectors([
+        FuncBatchLangDetector(ld.detect),
+        FuncBatchLangDetector(li_classify_str),
+        FastTextLangDetector(),
+    ], sample_texts, sample_gold_langs)
+
+    print('{} texts'.format(len(sample_texts)))
+    for detector_name, throughput in result['throughput'].items():
+        print('{}: {:.1f} texts/s'.format(detector_name, throughput), end='')
+        if detector_name in result['accuracy']:
+            print(', accuracy {:.2%}'.format(result['accuracy'][detector_name]), end='')
+        print()
+    for (name_1, name_2), agreement in result['agreement'].items():
+        print('{} vs {}: {:.2%} agreement'.format(name_1, name_2, agreement))
@@ -1,4 +1,5 @@
-from collections import defaultdict
+from collections import Counter, OrderedDict, defaultdict, namedtuple
+from bisect import bisect_left
 from typing import List, Tuple, Dict, Callable
 
 import os
@@ -22,44 +23,76 @@ import langdetect as ld
 
 
 class YoutubeUser:
+    __slots__ = ('name', 'img', 'img_hash', '_hash')
 
     def __init__(self, _name, _img):
         self.name: str = _name
         self.img: str = _img
+        self.img_hash: str = self.hash_img(_img)
+        self._hash = hash((self.name, self.img_hash))
 
-    def get_img_hash(self):
-        splited = self.img.split('/')
+    @staticmethod
+    def hash_img(img: str) -> str:
+        splited = img.split('/')
         return splited[3] + '_' + splited[-3]
 
+    def get_img_hash(self):
+        return self.img_hash
+
     def __eq__(self, other):
-        return (other.name == self.name) and (other.get_img_hash() == self.get_img_hash())
+        return (other.name == self.name) and (other.img_hash == self.img_hash)
 
     def __hash__(self):
-        return (self.name, self.get_img_hash()).__hash__()
+        return self._hash
+
+    def __getstate__(self):
+        return self.name, self.img
+
+    def __setstate__(self, state):
+        self.__init__(*state)
 
     def __repr__(self):
-        return '_'.join([self.name, self.get_img_hash()])
+        return '_'.join([self.name, self.img_hash])
 
     def pseudo_equal(self, o):
         if isinstance(o, str):
-            return self.name == o or self.img == o or self.get_img_hash() == o
+            return self.name == o or self.img == o or self.img_hash == o
         elif isinstance(o, YoutubeUser):
             return self == o
         else:
             raise TypeError
 
 
+# Compact record of a chat line, which references the user by uid, the position in YoutubeUserCollection.users
+UserLine = namedtuple('UserLine', ['uid', 'time_stamp', 'message', 'lang_message', 'lang_author_name'])
+
+
 class YoutubeUserCollection:
 
     def __init__(self, _multi_lang_chat_data_loader: MultiLangChatDataLoader,
                  file_name: str = None, target_path: str = None):
+        """
+        Attributes:
+            users (List[YoutubeUser]): uid -> YoutubeUser, each user is interned once
+            user_to_uid (Dict[YoutubeUser, int]): (name, img_hash) of YoutubeUser -> uid
+            match_to_lines (Dict[tuple, List[UserLine]]): lines of each match in order
+            uid_to_match_to_lines (List[Dict[tuple, List[UserLine]]]): uid -> match -> lines of the user
+            uid_to_lang_to_count (List[Counter]): uid -> lang_message -> the number of lines
+            key_to_uids (Dict[str, Dict[str, List[int]]]): 'name', 'img' or 'img_hash' -> value -> sorted uids
+            sorted_folded_names (List[tuple]): sorted (case-folded name, uid) for prefix queries
+        """
         self.multi_lang_chat_data_loader = _multi_lang_chat_data_loader
 
         if self.load(file_name, target_path):
             return
 
-        self.user_to_match_to_lines = self.get_user_to_match_to_lines()
-        self.user_to_lang_to_count = self.get_user_to_lang_to_count()
+        self.users: List[YoutubeUser] = []
+        self.user_to_uid: Dict[YoutubeUser, int] = {}
+        self.match_to_lines: Dict[tuple, List[UserLine]] = OrderedDict()
+        self.uid_to_match_to_lines: List[Dict[tuple, List[UserLine]]] = []
+        self.uid_to_lang_to_count: List[Counter] = []
+        self.build()
+        self.build_indexes()
 
     def __iter__(self):
 
@@ -70,11 +103,12 @@ class YoutubeUserCollection:
 
         message_criteria_func: Callable = default_message_criteria_func
 
-        for data_loader in self.multi_lang_chat_data_loader:
+        uid_to_repr = [str(user) for user in self.users]
+        for lines in self.match_to_lines.values():
             yield [';'.join([
-                str(YoutubeUser(line_dict['author_name'], line_dict['img'])),
-                line_dict['lang_message']
-            ]) for line_dict in data_loader if message_criteria_func(line_dict['message'])]
+                uid_to_repr[line.uid],
+                line.lang_message,
+            ]) for line in lines if message_criteria_func(line.message)]
 
     def dump(self, file_name: str = None, target_path: str = None):
         file_name = file_name or 'YoutubeUserCollection_{}.pkl'.format(self.multi_lang_chat_data_loader.info)
@@ -84,9 +118,13 @@ class YoutubeUserCollection:
             print('Dump Fail: {} already exists.'.format(file_name))
             return
 
+        multi_lang_chat_data_loader = self.multi_lang_chat_data_loader
         with open(os.path.join(target_path, file_name), 'wb') as f:
             self.multi_lang_chat_data_loader = None
-            pickle.dump(self, f)
+            try:
+                pickle.dump(self, f)
+            finally:
+                self.multi_lang_chat_data_loader = multi_lang_chat_data_loader
             print('Dumped: {}'.format(file_name))
 
     def load(self, file_name: str = None, target_path: str = None):
@@ -95,8 +133,13 @@ class YoutubeUserCollection:
         try:
             with open(os.path.join(target_path, file_name), 'rb') as f:
                 loaded: YoutubeUserCollection = pickle.load(f)
-                self.user_to_match_to_lines = loaded.user_to_match_to_lines
-                self.user_to_lang_to_count = loaded.user_to_lang_to_count
+                self.users = loaded.users
+                self.user_to_uid = loaded.user_to_uid
+                self.match_to_lines = loaded.match_to_lines
+                self.uid_to_match_to_lines = loaded.uid_to_match_to_lines
+                self.uid_to_lang_to_count = loaded.uid_to_lang_to_count
+                self.key_to_uids = loaded.key_to_uids
+                self.sorted_folded_names = loaded.sorted_folded_names
             print('Loaded: {}'.format(file_name))
             return True
         except Exception as e:
@@ -106,33 +149,97 @@ class YoutubeUserCollection:
     def get_lang_list(self) -> list:
         return self.multi_lang_chat_data_loader.get_lang_list()['message_lang']
 
-    def get_user_to_match_to_lines(self) -> Dict[YoutubeUser, Dict[tuple, list]]:
-        _user_to_match_to_lines: Dict[YoutubeUser, Dict[tuple, list]] = defaultdict(lambda: defaultdict(list))
-        for i, data_loader in enumerate(self.multi_lang_chat_data_loader):
+    def intern_user(self, name: str, img: str) -> int:
+        """
+        :return: uid of YoutubeUser(name, img), which is registered if it is new
+        """
+        user = YoutubeUser(name, img)
+        uid = self.user_to_uid.get(user)
+        if uid is None:
+            uid = len(self.users)
+            self.users.append(user)
+            self.user_to_uid[user] = uid
+            self.uid_to_match_to_lines.append({})
+            self.uid_to_lang_to_count.append(Counter())
+        return uid
+
+    def build(self):
+        """
+        Build users and lines in one pass over the columns of each match.
+        Each distinct (author_name, img) of a match is interned once, by codes of its EncodedColumn.
+        """
+        for data_loader in self.multi_lang_chat_data_loader:
             match_tuple = (
                 data_loader.get_label('country_1'),
                 data_loader.get_label('country_2'),
                 data_loader.get_label('main'),
                 len(data_loader),
             )
-            for line_dict in data_loader:
-                author_name = line_dict['author_name']
-                img = line_dict['img']
-                youtube_user = YoutubeUser(author_name, img)
-                _user_to_match_to_lines[youtube_user][match_tuple].append(line_dict)
-        return {k: v for k, v in _user_to_match_to_lines.items()}
-
-    def get_user_to_lang_to_count(self) -> Dict[YoutubeUser, Dict[str, int]]:
-        lang_list = self.get_lang_list()
-        _user_to_lang_to_count: Dict[YoutubeUser, Dict[str, int]] = defaultdict(lambda: {lang: 0 for lang in lang_list})
+            columns = data_loader.store.columns
+            author_name_column = columns['author_name']
+            img_column = columns['img']
+
+            codes_to_uid = {}
+            lines = []
+            for author_name_code, img_code, time_stamp, message, lang_message, lang_author_name in zip(
+                    author_name_column.codes, img_column.codes, columns['time_stamp'], columns['message'],
+                    columns['lang_message'], columns['lang_author_name']):
+                codes = (author_name_code, img_code)
+                uid = codes_to_uid.get(codes)
+                if uid is None:
+                    uid = codes_to_uid[codes] = self.intern_user(author_name_column.values[author_name_code],
+                                                                 img_column.values[img_code])
+                line = UserLine(uid, time_stamp, message, lang_message, lang_author_name)
+                lines.append(line)
+                self.uid_to_match_to_lines[uid].setdefault(match_tuple, []).append(line)
+                self.uid_to_lang_to_count[uid][lang_message] += 1
+            self.match_to_lines[match_tuple] = lines
+
+    def build_indexes(self):
+        self.key_to_uids: Dict[str, Dict[str, List[int]]] = {}
+        for key in ['name', 'img', 'img_hash']:
+            value_to_uids = defaultdict(list)
+            for uid, user in enumerate(self.users):
+                value_to_uids[getattr(user, key)].append(uid)
+            self.key_to_uids[key] = dict(value_to_uids)
+        self.sorted_folded_names: List[tuple] = sorted((user.name.casefold(), uid)
+                                                       for uid, user in enumerate(self.users))
+
+    def get_uids(self, target_user: YoutubeUser or str) -> List[int]:
+        """
+        :param target_user: YoutubeUser, or str of name, img or img_hash like YoutubeUser.pseudo_equal
+        :return: sorted uids of users that are equal to target_user
+        """
+        if isinstance(target_user, YoutubeUser):
+            uid = self.user_to_uid.get(target_user)
+            return [uid] if uid is not None else []
+        elif isinstance(target_user, str):
+            uids = set()
+            for value_to_uids in self.key_to_uids.values():
+                uids.update(value_to_uids.get(target_user, []))
+            return sorted(uids)
+        else:
+            raise TypeError
 
-        sorted_user_to_match_to_lines = sorted(self.get_user_to_match_to_lines().items(),
-                                               key=lambda x: -len(x[1].keys()))
-        for _user, _match_to_lines in sorted_user_to_match_to_lines:
-            for match, lines in _match_to_lines.items():
-                for line in lines:
-                    _user_to_lang_to_count[_user][line['lang_message']] += 1
-        return {k: v for k, v in _user_to_lang_to_count.items()}
+    def query_users_by_name_prefix(self, prefix: str) -> List[YoutubeUser]:
+        """
+        :return: users whose name starts with prefix, case-insensitively, in the order of names
+        """
+        folded_prefix = prefix.casefold()
+        r = []
+        for folded_name, uid in self.sorted_folded_names[bisect_left(self.sorted_folded_names, (folded_prefix,)):]:
+            if not folded_name.startswith(folded_prefix):
+                break
+            r.append(self.users[uid])
+        return r
+
+    @property
+    def user_to_match_to_lines(self) -> Dict[YoutubeUser, Dict[tuple, List[UserLine]]]:
+        return dict(zip(self.users, self.uid_to_match_to_lines))
+
+    @property
+    def user_to_lang_to_count(self) -> Dict[YoutubeUser, Counter]:
+        return dict(zip(self.users, self.uid_to_lang_to_count))
 
     def export_user_stats(self, criteria_func: Callable = None):
         lang_list = self.get_lang_list()
@@ -140,24 +247,25 @@ class YoutubeUserCollection:
         writer = WriterWrapper('../Data/Users_{}_{}'.format(
             criteria_func.__name__, self.multi_lang_chat_data_loader.info
         ), _fieldnames=fieldnames)
-        for _user, _match_to_lines in self.user_to_match_to_lines:
+        for _user, _match_to_lines, _lang_to_count in zip(self.users, self.uid_to_match_to_lines,
+                                                           self.uid_to_lang_to_count):
             row = {
                 'name': _user.name,
                 'img': _user.img,
                 'matches': len(_match_to_lines.keys()),
                 'lines': sum([len(x) for x in _match_to_lines.values()]),
             }
-            row.update(self.user_to_lang_to_count[_user])
+            row.update({lang: _lang_to_count[lang] for lang in lang_list})
             if (not criteria_func) or criteria_func(row):
                 writer.write_row(row)
 
-    def query_match_to_lines_of_user(self, target_user: YoutubeUser or str):
-        if isinstance(target_user, str):
-            for user, match_to_lines in self.user_to_match_to_lines.items():
-                if user.pseudo_equal(target_user):
-                    return match_to_lines
-        else:
-            raise NotImplementedError
+    def query_match_to_lines_of_user(self, target_user: YoutubeUser or str) -> Dict[tuple, List[UserLine]] or None:
+        """
+        :param target_user: YoutubeUser, or str of name, img or img_hash
+        :return: match_to_lines of the first user that is equal to target_user, None if there is no such user
+        """
+        uids = self.get_uids(target_user)
+        return self.uid_to_match_to_lines[uids[0]] if uids else None
 
 
 def display_tsne(gensim_model, word_list, vector_size=100,
@@ -211,9 +319,6 @@ if __name__ == '__main__':
         lang_func=li_classify_str,
     )
 
-    if multi_lang_chat_data_loader.is_dump_possible():
-        multi_lang_chat_data_loader.dump()
-
     user_collection = YoutubeUserCollection(multi_lang_chat_data_loader)
     user_collection.dump()
 
@@ -238,13 +343,18 @@ if __name__ == '__main__':
         # user_something = 'Arturo Jara'
         user_something = 'chris kim'
         match_to_lines_of_user = user_collection.query_match_to_lines_of_user(user_something)
+        if match_to_lines_of_user is None:
+            print('No user: {}, users with the prefix: {}'.format(
+                user_something, user_collection.query_users_by_name_prefix(user_something)))
+            match_to_lines_of_user = {}
         line = None
         print('User: {}'.format(user_something))
         for match, lines in match_to_lines_of_user.items():
             print('# ' + '_'.join(map(str, match)))
             for line in lines:
-                print('\t', line['lang_message'], line['message'])
-        print('lang_author_name: {}'.format(line['lang_author_name']))
+                print('\t', line.lang_message, line.message)
+        if line is not None:
+            print('lang_author_name: {}'.format(line.lang_author_name))
 
     elif MODE == 'USER_AND_MSG_LANG_TO_VECTOR':
         list_user_collection = [list(x) for x in user_collection]
@@ -0,0 +1,67 @@
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+import os
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixture')
+
+
+class QuietHTTPRequestHandler(SimpleHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class ChatReplayServer:
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        """
+        Serve fixture/ that stands in for Youtube without network.
+            watch.html: watch page with a video, and the #chatframe iframe of chat.html
+            chat.html: chat replay that renders 'yt-live-chat-text-message-renderer' at a given rate
+            videos.html: video list of a channel that loads more '#dismissable' on scrolls
+        :param host: host to bind
+        :param port: port to bind, 0 for any free port
+        """
+        self.server = ThreadingHTTPServer((host, port), partial(QuietHTTPRequestHandler, directory=FIXTURE_PATH))
+        self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return 'http://{0}:{1}'.format(host, port)
+
+    def start(self):
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_watch_url_dict(self, duration: int, rate: float, window: int = 250) -> dict:
+        """
+        :param duration: sec of the video
+        :param rate: chats per sec of the video
+        :param window: max number of rendered chats, older ones are removed from the DOM
+        :return: url_dict of ChatCrawler {'title', 'video_url', 'time'}
+        """
+        return {
+            'title': 'Fixture_{0}s_{1}cps'.format(duration, rate),
+            'video_url': '{0}/watch.html?duration={1}&rate={2}&window={3}'.format(self.url, duration, rate, window),
+            'time': '{0}:{1:02d}'.format(duration // 60, duration % 60),
+        }
+
+    def get_videos_url(self, count: int, page: int = 30) -> str:
+        """
+        :param count: number of videos in the list
+        :param page: number of videos loaded per scroll to the bottom
+        """
+        return '{0}/videos.html?count={1}&page={2}'.format(self.url, count, page)
@@ -0,0 +1,114 @@
+from ChatCrawler import ChatCrawler
+from VideoURLCrawler import VideoURLCrawler
+from WriterWrapper import WriterWrapper
+from ChatReplayServer import ChatReplayServer
+from collections import Counter
+from time import time
+import csv
+import os
+import re
+import tempfile
+
+
+def timed(f, elapsed_list: list):
+    """
+    :return: wrapper of f that appends the time consumed by each call to elapsed_list
+    """
+    def wrapper(*args, **kwargs):
+        start_time = time()
+        result = f(*args, **kwargs)
+        elapsed_list.append(time() - start_time)
+        return result
+
+    return wrapper
+
+
+def benchmark_chat_crawler(config_file_path: str, server: ChatReplayServer, extraction_mode: str,
+                           duration: int, rate: float, window: int, driver_profile: dict = None) -> dict:
+    """
+    :return: {'chats', 'expected_chats', 'chats_per_sec', 'epoch_latency_mean', 'epoch_latency_max',
+              'duplicate_rate', 'missed'}
+    """
+    tmp_path = tempfile.mkdtemp()
+    crawler = ChatCrawler(
+        config_file_path,
+        video_speed_rate=4,
+        interval_to_crawl=5,
+        extraction_mode=extraction_mode,
+        drain_interval_in_sec=1,
+        manifest_path=os.path.join(tmp_path, 'ChatManifest.json'),
+        driver_profile=driver_profile,
+    )
+    crawler.max_wait_to_start = 0
+    crawler.wait_to_crawl_range = (1, 1)
+
+    epoch_latency_list = []
+    crawler.get_chat_tuples = timed(crawler.get_chat_tuples, epoch_latency_list)
+    crawler.drain_chat_queue = timed(crawler.drain_chat_queue, epoch_latency_list)
+
+    url_dict = server.get_watch_url_dict(duration, rate, window)
+    writer = WriterWrapper(os.path.join(tmp_path, extraction_mode), crawler.fieldnames)
+    start_time = time()
+    crawler.run_one(url_dict, writer)
+    wall_time = time() - start_time
+    crawler.quit_driver()
+    writer.close()
+
+    # The n-th chat of the fixture has the message 'Message n'.
+    with open(writer.file_name, 'r', encoding='utf-8') as f:
+        chat_numbers = [int(re.search(r'\d+', line_dict['message']).group()) for line_dict in csv.DictReader(f)]
+    number_to_count = Counter(chat_numbers)
+    expected_chats = int(duration * rate)
+
+    return {
+        'chats': len(chat_numbers),
+        'expected_chats': expected_chats,
+        'chats_per_sec': len(chat_numbers) / wall_time,
+        'epoch_latency_mean': sum(epoch_latency_list) / len(epoch_latency_list) if epoch_latency_list else 0,
+        'epoch_latency_max': max(epoch_latency_list) if epoch_latency_list else 0,
+        'duplicate_rate': (len(chat_numbers) - len(number_to_count)) / len(chat_numbers) if chat_numbers else 0,
+        'missed': len([n for n in range(expected_chats) if n not in number_to_count]),
+    }
+
+
+def benchmark_video_url_crawler(config_file_path: str, server: ChatReplayServer, count: int,
+                                number_of_scroll: int, driver_profile: dict = None) -> dict:
+    """
+    :return: {'videos', 'expected_videos', 'wall_time'}
+    """
+    crawler = VideoURLCrawler(
+        config_file_path,
+        target_url=server.get_videos_url(count),
+        number_of_scroll=number_of_scroll,
+        driver_profile=driver_profile,
+    )
+    start_time = time()
+    videos = crawler.run(search_text_list=['conference'])
+    wall_time = time() - start_time
+
+    return {
+        'videos': len(videos),
+        'expected_videos': len(range(0, count, 3)),
+        'wall_time': wall_time,
+    }
+
+
+if __name__ == '__main__':
+    config_file_path = '../crawl/config.ini'
+
+    with ChatReplayServer() as chat_replay_server:
+
+        for mode in ['element', 'script', 'observer']:
+            result = benchmark_chat_crawler(config_file_path, chat_replay_server, mode,
+                                            duration=180, rate=10, window=250)
+            print('{0} | {1}/{2} chats | {3:.1f} chats/s | epoch {4:.3f}s (max {5:.3f}s) | '
+                  'duplicate {6:.2%} | missed {7}'.format(
+                    mode, result['chats'], result['expected_chats'], result['chats_per_sec'],
+                    result['epoch_latency_mean'], result['epoch_latency_max'],
+                    result['duplicate_rate'], result['missed'],
+                  ))
+
+        result = benchmark_video_url_crawler(config_file_path, chat_replay_server, count=300, number_of_scroll=10)
+        print('VideoURL | {0}/{1} videos | {2:.1f}s'.format(
+            result['videos'], result['expected_videos'], result['wall_time'],
+        ))
@@ -0,0 +1,79 @@
+from ChatCrawler import ChatCrawler
+from ChatReplayServer import ChatReplayServer
+from time import time
+import os
+import resource
+import tempfile
+
+# Profiles to compare, which override the [DRIVER] section of config.ini.
+DRIVER_PROFILES = {
+    'full': {
+        'HEADLESS': 'false',
+    },
+    'headless': {
+        'HEADLESS': 'true',
+    },
+    'light': {
+        'HEADLESS': 'true',
+        'LOAD_IMAGES': 'false',
+        'DISABLE_GPU': 'true',
+        'DISABLE_EXTENSIONS': 'true',
+        'WINDOW_SIZE': '640,360',
+        'VIDEO_QUALITY': 'tiny',
+    },
+}
+
+
+def get_cpu_time() -> float:
+    """
+    :return: user + system time of this process and its waited children (chromedriver and Chrome) in sec
+    """
+    usage_self = resource.getrusage(resource.RUSAGE_SELF)
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage_self.ru_utime + usage_self.ru_stime + usage_children.ru_utime + usage_children.ru_stime
+
+
+def benchmark_driver_profile(config_file_path: str, driver_profile: dict, server: ChatReplayServer,
+                             duration: int, rate: float, extraction_mode: str) -> dict:
+    crawler = ChatCrawler(
+        config_file_path,
+        video_speed_rate=4,
+        interval_to_crawl=5,
+        extraction_mode=extraction_mode,
+        manifest_path=os.path.join(tempfile.gettempdir(), 'ChatManifest_benchmark.json'),
+        driver_profile=driver_profile,
+    )
+    crawler.max_wait_to_start = 0
+    crawler.wait_to_crawl_range = (1, 1)
+
+    url_dict = server.get_watch_url_dict(duration, rate)
+
+    start_cpu_time, start_time = get_cpu_time(), time()
+    chats = crawler.run_one(url_dict) or 0
+    crawler.quit_driver()
+    cpu_time, wall_time = get_cpu_time() - start_cpu_time, time() - start_time
+
+    return {
+        'chats': chats,
+        'expected_chats': int(duration * rate),
+        'cpu_time': cpu_time,
+        'wall_time': wall_time,
+        'chats_per_cpu_sec': chats / cpu_time if cpu_time else 0,
+    }
+
+
+if __name__ == '__main__':
+    with ChatReplayServer() as chat_replay_server:
+        for name, profile in DRIVER_PROFILES.items():
+            result = benchmark_driver_profile(
+                config_file_path='../crawl/config.ini',
+                driver_profile=profile,
+                server=chat_replay_server,
+                duration=120,
+                rate=10,
+                extraction_mode='script',
+            )
+            print('{0} | {1}/{2} chats | {3:.2f} cpu sec | {4:.2f} wall sec | {5:.1f} chats/cpu sec'.format(
+                name, result['chats'], result['expected_chats'], result['cpu_time'], result['wall_time'],
+                result['chats_per_cpu_sec'],
+            ))
@@ -1,10 +1,15 @@
 class BaseCrawler:
 
-    def __init__(self, config_file_path: str):
+    def __init__(self, config_file_path: str, driver_profile: dict = None):
+        """
+        :param config_file_path: path of .ini file
+        :param driver_profile: keys and values that override the [DRIVER] section of config.ini
+        """
         self.driver = None
         self.prefix = None
         self.fieldnames = []
         self.config_file_path = config_file_path
+        self.driver_profile = driver_profile
 
     def run(self, *args, **kwargs):
         raise NotImplementedError
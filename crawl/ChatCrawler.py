@@ -1,25 +1,106 @@
 # -*- coding: utf-8 -*-
 
-from custom_path import DATA_PATH, CHAT_PATH
-from utill import try_except_with_sleep, get_driver, iso2sec
+from custom_path import DATA_PATH, CHAT_PATH, VIDEO_CATALOG_PATH
+from utill import try_except_with_wait, wait_until_present, wait_until_clickable, get_driver, get_driver_profile, \
+    is_true, iso2sec
 from BaseCrawler import BaseCrawler
 from WriterWrapper import WriterWrapper
+from CrawlManifest import CrawlManifest
+from VideoCatalog import VideoCatalog
 from time import sleep, time
-from multiprocessing import Process
+from multiprocessing import Process, Queue
+from queue import Empty
+from collections import defaultdict, deque, OrderedDict
+from typing import Callable
 import csv
 import os
 import sys
 import random
 from termcolor import cprint
-try:
-    from orderedset import OrderedSet
-except:
-    pass
+
+
+# Define getRow(chatEmt) -> [id, time_stamp, author_name, message, img] in the chat iframe.
+GET_ROW_FUNCTION = '''
+var getText = function (parent, id) {
+    var emt = parent.querySelector('#' + id);
+    if (!emt) { throw new Error('No #' + id); }
+    return emt.innerText;
+};
+var getRow = function (chatEmt) {
+    var contentEmt = chatEmt.querySelector('#content');
+    if (!contentEmt) { throw new Error('No #content'); }
+    var imgEmt = chatEmt.querySelector('#img');
+    return [
+        chatEmt.id,
+        getText(contentEmt, 'timestamp'),
+        getText(contentEmt, 'author-name'),
+        getText(contentEmt, 'message'),
+        imgEmt ? imgEmt.getAttribute('src') : 'Error'
+    ];
+};
+'''
+
+# Collect (id, time_stamp, author_name, message, img) of chats in the chat iframe in one round-trip.
+# Only chats appended after the high-water mark, arguments[0] (DOM id) or arguments[1] (row), are collected.
+# If the mark is not in the page anymore, every chat is collected.
+EXTRACT_CHATS_SCRIPT = GET_ROW_FUNCTION + '''
+var lastId = arguments[0], lastRow = arguments[1];
+var chatEmts = document.querySelectorAll('yt-live-chat-text-message-renderer');
+var begin = 0;
+for (var i = chatEmts.length - 1; i >= 0 && (lastId || lastRow); i--) {
+    if (lastId && chatEmts[i].id === lastId) { begin = i + 1; break; }
+    if (!lastId && getRow(chatEmts[i]).slice(1).join('\\n') === lastRow.join('\\n')) { begin = i + 1; break; }
+}
+var rows = [];
+for (var j = begin; j < chatEmts.length; j++) {
+    rows.push(getRow(chatEmts[j]));
+}
+return rows;
+'''
+
+# Install a MutationObserver in the chat iframe that pushes new chat nodes into window.chatQueue.
+INSTALL_CHAT_OBSERVER_SCRIPT = '''
+if (window.chatObserver) { window.chatObserver.disconnect(); }
+window.chatQueue = Array.prototype.slice.call(document.querySelectorAll('yt-live-chat-text-message-renderer'));
+window.chatObserver = new MutationObserver(function (mutations) {
+    mutations.forEach(function (mutation) {
+        mutation.addedNodes.forEach(function (node) {
+            if (node.nodeName && node.nodeName.toLowerCase() === 'yt-live-chat-text-message-renderer') {
+                window.chatQueue.push(node);
+            }
+        });
+    });
+});
+window.chatObserver.observe(document.body, {childList: true, subtree: true});
+'''
+
+# Drain window.chatQueue and return {rows, ended} where ended is whether the video in the parent page ended.
+# Nodes that are not rendered yet stay in the queue for the next drain,
+# but nodes removed from the page or failed in MAX_DRAIN_FAILURES drains are dropped.
+MAX_DRAIN_FAILURES = 5
+DRAIN_CHAT_QUEUE_SCRIPT = GET_ROW_FUNCTION + '''
+var queue = window.chatQueue || [];
+var rows = [], notRendered = [];
+for (var i = 0; i < queue.length; i++) {
+    var node = queue[i];
+    try {
+        rows.push(getRow(node));
+    } catch (e) {
+        node.drainFailures = (node.drainFailures || 0) + 1;
+        if (node.isConnected && node.drainFailures < %d) { notRendered.push(node); }
+    }
+}
+window.chatQueue = notRendered;
+var video = window.parent.document.getElementsByTagName('video')[0];
+return {rows: rows, ended: video ? video.ended : false};
+''' % MAX_DRAIN_FAILURES
 
 
 class ChatCrawler(BaseCrawler):
 
-    def __init__(self, config_file_path: str, video_speed_rate: float=3.3, interval_to_crawl: int=30):
+    def __init__(self, config_file_path: str, video_speed_rate: float=3.3, interval_to_crawl: int=30,
+                 extraction_mode: str='element', drain_interval_in_sec: float=2.0, manifest_path: str=None,
+                 max_recent_chats: int=3000, driver_profile: dict=None, catalog_path: str=None):
         """
         :param config_file_path: path of .ini file
             config.ini
@@ -27,10 +108,24 @@ class ChatCrawler(BaseCrawler):
                 PATH="Something"
         :param video_speed_rate: video speed
         :param interval_to_crawl: interval to crawl in sec
+        :param extraction_mode: 'element' or 'script'
+            'element': find elements of each chat one by one (five round-trips per chat).
+            'script': extract chats in the iframe with one execute_script call.
+                Only chats appended after the last harvested one (the high-water mark) are extracted.
+            'observer': install a MutationObserver in the iframe and drain its queue
+                every drain_interval_in_sec without pausing the video.
+        :param drain_interval_in_sec: interval to drain the observer queue in sec (only for 'observer')
+        :param manifest_path: path of the manifest of exported videos, DATA_PATH/ChatManifest.json by default.
+            Videos that are 'done' in the manifest are skipped by export and export_with_multiprocess.
+        :param max_recent_chats: number of recent chats to remember for dropping duplicates.
+            Chats are appended to the output file every epoch, so memory is bounded by this.
+        :param driver_profile: keys and values that override the [DRIVER] section, e.g. {'HEADLESS': 'true'}
+        :param catalog_path: path of the video catalog written by VideoURLCrawler, VIDEO_CATALOG_PATH by default.
+            The status of each video in the catalog is updated with the manifest.
 
         We will recommend that interval_to_crawl * video_speed_rate < 2*60 ~ 3*60 (2 ~ 3 min)
         """
-        super().__init__(config_file_path)
+        super().__init__(config_file_path, driver_profile)
         self.urls = []
         self.prefix = 'Chat'
         self.fieldnames = ['time_stamp', 'author_name', 'message', 'img']
@@ -38,101 +133,325 @@ class ChatCrawler(BaseCrawler):
         self.video_speed_rate = video_speed_rate
         self.interval_to_crawl = interval_to_crawl
 
+        # Random waits before starting a video and before crawling it, in sec.
+        self.max_wait_to_start = 50
+        self.wait_to_crawl_range = (5, 8)
+
+        if extraction_mode not in ('element', 'script', 'observer'):
+            raise ValueError('extraction_mode should be element, script or observer, not {0}'.format(
+                extraction_mode))
+        self.extraction_mode = extraction_mode
+        self.drain_interval_in_sec = drain_interval_in_sec
+
+        # High-water mark: DOM id and tuple of the last harvested chat.
+        self.last_chat_id = None
+        self.last_chat_tuple = None
+
+        # Recently written chat tuples (as an ordered set) to drop duplicates, bounded by max_recent_chats.
+        self.recent_chat_tuples = OrderedDict()
+        self.max_recent_chats = max_recent_chats
+
+        self.manifest = CrawlManifest(manifest_path or os.path.join(DATA_PATH, 'ChatManifest.json'))
+        self.catalog = VideoCatalog(catalog_path or VIDEO_CATALOG_PATH)
+
+        # Time consumed by each action decorated by try_except_with_wait in the current video.
+        self.action_to_waited_time = defaultdict(float)
+
         if video_speed_rate * interval_to_crawl >= 2*60:
             print('We recommend that interval_to_crawl * video_speed_rate < 2*60 ~ 3*60 (2 ~ 3 min)',
                   'Yours is {0}'.format(video_speed_rate*interval_to_crawl))
 
-    def get_urls(self) -> csv.DictReader:
-        video_url_filename = [os.path.join(DATA_PATH, f) for f in os.listdir(DATA_PATH)
-                              if f.startswith('VideoURL')][0]
-        reader = csv.DictReader(open(video_url_filename, 'r', encoding='utf-8'))
-        return reader
+    def get_urls(self) -> list:
+        """
+        :return: list of url_dict {'title', 'video_url', 'time'} in the catalog,
+            or in the latest VideoURL_*.csv if the catalog is empty.
+        """
+        if len(self.catalog):
+            return self.catalog.get_url_dicts()
 
-    @try_except_with_sleep
+        video_url_filename = max([os.path.join(DATA_PATH, f) for f in os.listdir(DATA_PATH)
+                                  if f.startswith('VideoURL')], key=os.path.getmtime)
+        with open(video_url_filename, 'r', encoding='utf-8') as f:
+            return list(csv.DictReader(f))
+
+    def get_urls_to_crawl(self) -> list:
+        """
+        :return: list of url_dict that are not 'done' in the manifest
+        """
+        url_dict_list = self.get_urls()
+        url_dict_list_to_crawl = [url_dict for url_dict in url_dict_list
+                                  if not self.manifest.is_done(url_dict['video_url'])]
+        print('{0}/{1} videos to crawl, the others are done in the manifest'.format(
+            len(url_dict_list_to_crawl), len(url_dict_list)))
+        return url_dict_list_to_crawl
+
+    def record(self, url_dict: dict, record: dict):
+        """
+        :param url_dict: {'title', 'video_url', 'time'}
+        :param record: {'status', 'rows', 'file_name', 'attempt_counts'} returned by export_one
+        """
+        self.manifest.update(url_dict['video_url'], title=url_dict['title'], **record)
+        self.catalog.set_status(url_dict['video_url'], record['status'])
+
+    @try_except_with_wait
     def turn_off_autoplay(self):
-        sleep(0.3)
-        btn_turn_off = self.driver.find_element_by_id('improved-toggle')
-        btn_turn_off.click()
+        # Youtube keeps autoplay across videos in a session, so click only if it is on.
+        btn_turn_off = wait_until_clickable(self.driver, '#improved-toggle')
+        if btn_turn_off.get_attribute('aria-pressed') == 'true' or btn_turn_off.get_attribute('checked'):
+            btn_turn_off.click()
 
-    @try_except_with_sleep
+    @try_except_with_wait
     def mute(self):
-        btn_mute = self.driver.find_element_by_class_name('ytp-mute-button')
-        btn_mute.click()
+        # Set the video, not the button, which is not clickable while the control bar fades out.
+        # Youtube keeps mute across videos in a session, and setting muted is idempotent.
+        wait_until_present(self.driver, 'video')
+        self.driver.execute_script('document.getElementsByTagName("video")[0].muted = true;')
 
-    @try_except_with_sleep
+    @try_except_with_wait
     def speed_up(self):
+        wait_until_present(self.driver, 'video')
         self.driver.execute_script(
             'document.getElementsByTagName("video")[0].playbackRate = {0}'.format(self.video_speed_rate)
         )
 
-    @try_except_with_sleep
+    @try_except_with_wait
+    def set_video_quality(self, quality: str):
+        """
+        :param quality: e.g. 'tiny' (144p), 'small' (240p)
+        """
+        wait_until_present(self.driver, '#movie_player')
+        self.driver.execute_script(
+            'var player = document.getElementById("movie_player");'
+            'if (player.setPlaybackQualityRange) {{ player.setPlaybackQualityRange("{0}", "{0}"); }}'
+            'if (player.setPlaybackQuality) {{ player.setPlaybackQuality("{0}"); }}'.format(quality)
+        )
+
+    @try_except_with_wait
     def show_timestamp(self):
-        btn_top = self.driver.find_element_by_css_selector('#overflow')
+        btn_top = wait_until_clickable(self.driver, '#overflow')
         btn_top.click()
-        sleep(0.5)
-        btn_bottom = self.driver.find_element_by_css_selector('#items > ytd-menu-service-item-renderer')
+        btn_bottom = wait_until_clickable(self.driver, '#items > ytd-menu-service-item-renderer')
         btn_bottom.click()
 
-    @try_except_with_sleep
+    @try_except_with_wait
     def click_show_more(self):
-        btn_show_more = self.driver.find_element_by_css_selector('#show-more')
+        btn_show_more = wait_until_present(self.driver, '#show-more')
         if btn_show_more.is_displayed():
             btn_show_more.click()
 
-    @try_except_with_sleep
+    @try_except_with_wait
     def click_play_toggle(self):
+        # Pause or play the video, not the button, which is not clickable while the control bar fades out.
+        # If video is finished, do not play it again.
         self.driver.switch_to.default_content()
-        sleep(0.3)
-        btn_play = self.driver.find_element_by_css_selector('.ytp-play-button')
-
-        # If video is finished, do not click.
-        if btn_play.get_attribute('title') != '다시보기':
-            btn_play.click()
-            sleep(0.3)
+        wait_until_present(self.driver, 'video')
+        self.driver.execute_script(
+            'var video = document.getElementsByTagName("video")[0];'
+            'if (!video.ended) { if (video.paused) { video.play(); } else { video.pause(); } }'
+        )
         self.driver.switch_to.frame(self.chat_iframe)
 
     def get_element_by_id(self, parent_emt, html_id):
         r_emt = parent_emt.find_element_by_id(html_id)
         return r_emt
 
+    def get_chat_tuples_by_element(self) -> list:
+        """
+        :return: list of tuple (time_stamp, author_name, message, img)
+        """
+        r = []
+        for chat_emt in self.driver.find_elements_by_css_selector('yt-live-chat-text-message-renderer'):
+            content_emt = chat_emt.find_element_by_id('content')
+            time_stamp = self.get_element_by_id(content_emt, 'timestamp')
+            author_name = self.get_element_by_id(content_emt, 'author-name')
+            message = self.get_element_by_id(content_emt, 'message')
+            img = self.get_element_by_id(chat_emt, 'img')
+            img_src = img.get_attribute('src') if img != 'Error' else 'Error'
+            r.append((time_stamp.text, author_name.text, message.text, img_src))
+        return r
+
+    def get_chat_tuples_by_script(self) -> list:
+        """
+        :return: list of tuple (time_stamp, author_name, message, img) appended after the high-water mark
+        """
+        rows = self.driver.execute_script(EXTRACT_CHATS_SCRIPT, self.last_chat_id,
+                                          list(self.last_chat_tuple) if self.last_chat_tuple else None)
+        if rows:
+            self.last_chat_id = rows[-1][0] or None
+            self.last_chat_tuple = tuple(rows[-1][1:])
+        return [tuple(row[1:]) for row in rows]
+
+    def install_chat_observer(self):
+        self.driver.execute_script(INSTALL_CHAT_OBSERVER_SCRIPT)
+
+    def drain_chat_queue(self) -> tuple:
+        """
+        :return: (list of tuple (time_stamp, author_name, message, img), whether the video ended)
+        """
+        drained = self.driver.execute_script(DRAIN_CHAT_QUEUE_SCRIPT)
+        return [tuple(row[1:]) for row in drained['rows']], drained['ended']
+
+    def reset_high_water_mark(self):
+        self.last_chat_id = None
+        self.last_chat_tuple = None
+
+    def get_chat_tuples(self) -> list:
+        if self.extraction_mode == 'script':
+            return self.get_chat_tuples_by_script()
+        return self.get_chat_tuples_by_element()
+
+    def is_driver_alive(self) -> bool:
+        if self.driver is None:
+            return False
+        try:
+            _ = self.driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def get_alive_driver(self):
+        """
+        :return: self.driver if its session is alive, a new driver otherwise.
+        """
+        if self.is_driver_alive():
+            return self.driver
+
+        self.quit_driver()
+        self.driver = get_driver(self.config_file_path, self.driver_profile)
+        if not is_true(get_driver_profile(self.config_file_path, self.driver_profile)['HEADLESS']):
+            self.driver.set_window_position(-1800, 0)
+        return self.driver
+
+    def quit_driver(self):
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except Exception as e:
+                print('P{0} | Error: quit_driver'.format(os.getpid()), e, file=sys.stderr)
+        self.driver = None
+
     def run(self):
         for url_dict in self.get_urls():
+            self.recent_chat_tuples.clear()
             self.run_one(url_dict)
+        self.quit_driver()
 
-    def run_one(self, url_dict: dict) -> list:
+    def run_one(self, url_dict: dict, writer: WriterWrapper = None, resume_time_stamp: str = None) -> int or None:
         """
         :param url_dict: {'title', 'video_url', 'time'}
-        :return: list of dict {'time_stamp', 'author_name', 'message', 'img'}
+        :param writer: WriterWrapper that new chats {'time_stamp', 'author_name', 'message', 'img'} are appended to
+            and flushed every epoch
+        :param resume_time_stamp: time_stamp of the last persisted chat to resume the video from, e.g. 1:01:02
+        :return: number of new chats, or None if a fatal error occurs
         """
         title, video_url, play_time = url_dict['title'], url_dict['video_url'], url_dict['time']
         time_in_sec = iso2sec(play_time)
+        resume_sec = self.time_stamp_to_sec(resume_time_stamp) if resume_time_stamp else 0
 
-        wait_to_start, wait_to_crawl = 50*random.random()*random.random(), random.randrange(5, 8)
-        cprint('P{0} | {4} | Begin | {1} | wait_to_start: {2}, wait_to_crawl: {3}'.format(
-            os.getpid(), title, wait_to_start, wait_to_crawl, play_time
+        wait_to_start = self.max_wait_to_start*random.random()*random.random()
+        wait_to_crawl = random.uniform(*self.wait_to_crawl_range)
+        cprint('P{0} | {4} | Begin | {1} | wait_to_start: {2}, wait_to_crawl: {3}, resume_from: {5}'.format(
+            os.getpid(), title, wait_to_start, wait_to_crawl, play_time, resume_time_stamp
         ), 'green')
 
         sleep(wait_to_start)
 
-        self.driver = get_driver(self.config_file_path)
-        self.driver.get(video_url)
+        # Reuse the driver of this worker, which is reset by navigating to the next video.
+        try:
+            self.get_alive_driver().get(video_url)
+        except Exception as e:
+            print('Fatal Error: {0}'.format(title), str(e), file=sys.stderr)
+            self.quit_driver()
+            return None
+        self.reset_high_water_mark()
+        self.action_to_waited_time.clear()
 
         sleep(wait_to_crawl)
 
         self.mute()
         self.turn_off_autoplay()
         self.speed_up()
+        video_quality = get_driver_profile(self.config_file_path, self.driver_profile)['VIDEO_QUALITY']
+        if video_quality:
+            self.set_video_quality(video_quality)
+        if resume_sec:
+            self.seek(resume_sec)
+
+        try:
+            self.chat_iframe = self.driver.find_element_by_css_selector('#chatframe')
+            self.driver.switch_to.frame(self.chat_iframe)
+        except Exception as e:
+            print('Fatal Error: {0}'.format(title), str(e), file=sys.stderr)
+            new_chat_counts = None
+        else:
+            self.show_timestamp()
+
+            self.click_show_more()
+
+            if self.extraction_mode == 'observer':
+                new_chat_counts = self.crawl_by_observer(writer, title, play_time, time_in_sec - resume_sec)
+            else:
+                new_chat_counts = self.crawl_by_polling(writer, title, play_time, time_in_sec - resume_sec)
+
+        if new_chat_counts is None:
+            # Replace only a crashed session, a live one is reused by the next attempt.
+            if self.is_driver_alive():
+                self.driver.switch_to.default_content()
+            else:
+                self.quit_driver()
+            return None
 
-        self.chat_iframe = self.driver.find_element_by_css_selector('#chatframe')
-        self.driver.switch_to.frame(self.chat_iframe)
+        self.driver.switch_to.default_content()
+        cprint('P{0} | {2} | End | {1}'.format(os.getpid(), title, play_time), 'blue')
+        print('P{0} | {2} | Waited | {1} | {3}'.format(
+            os.getpid(), title, play_time,
+            ', '.join('{0}: {1:.2f}s'.format(k, v) for k, v in self.action_to_waited_time.items()),
+        ))
+
+        return new_chat_counts
+
+    @try_except_with_wait
+    def seek(self, sec: int):
+        wait_until_present(self.driver, 'video')
+        self.driver.execute_script('document.getElementsByTagName("video")[0].currentTime = {0}'.format(sec))
+
+    @staticmethod
+    def time_stamp_to_sec(time_stamp: str) -> int:
+        # Chats before the start of the video have negative time_stamps like -0:30.
+        try:
+            return 0 if time_stamp.startswith('-') else iso2sec(time_stamp)
+        except Exception:
+            return 0
+
+    def write_new_chat_tuples(self, writer: WriterWrapper or None, chat_tuples: list) -> int:
+        """
+        :param writer: WriterWrapper to append and flush new chats, or None to only count them
+        :param chat_tuples: list of tuple (time_stamp, author_name, message, img)
+        :return: number of chat tuples not in recent_chat_tuples
+        """
+        new_chat_tuples = []
+        for chat_tuple in chat_tuples:
+            if chat_tuple not in self.recent_chat_tuples:
+                self.recent_chat_tuples[chat_tuple] = None
+                new_chat_tuples.append(chat_tuple)
 
-        self.show_timestamp()
+        while len(self.recent_chat_tuples) > self.max_recent_chats:
+            self.recent_chat_tuples.popitem(last=False)
 
-        self.click_show_more()
+        if writer and new_chat_tuples:
+            writer.write_rows([dict(zip(self.fieldnames, chat_tuple)) for chat_tuple in new_chat_tuples])
+            writer.flush()
 
-        self.driver.set_window_position(-1800, 0)
+        return len(new_chat_tuples)
 
-        r_set = OrderedSet()
+    def crawl_by_polling(self, writer: WriterWrapper or None, title: str, play_time: str,
+                         time_in_sec: int) -> int or None:
+        """
+        Pause the video every interval_to_crawl sec, write new chats, and resume the video.
+        :param time_in_sec: remaining time of the video in sec
+        :return: number of new chats, or None if a fatal error occurs
+        """
+        new_chat_counts = 0
         epochs = int(time_in_sec/self.video_speed_rate/self.interval_to_crawl) + 1
         for i in range(epochs):
 
@@ -142,80 +461,192 @@ class ChatCrawler(BaseCrawler):
             self.click_play_toggle()
 
             start_time = time()
-            for chat_emt in self.driver.find_elements_by_css_selector('yt-live-chat-text-message-renderer'):
+            try:
+                chat_tuples = self.get_chat_tuples()
+                new_chat_counts_in_one_epoch = self.write_new_chat_tuples(writer, chat_tuples)
+                new_chat_counts += new_chat_counts_in_one_epoch
 
-                try:
-                    content_emt = chat_emt.find_element_by_id('content')
-                    time_stamp = self.get_element_by_id(content_emt, 'timestamp')
-                    author_name = self.get_element_by_id(content_emt, 'author-name')
-                    message = self.get_element_by_id(content_emt, 'message')
-                    img = self.get_element_by_id(chat_emt, 'img')
-                    img_src = img.get_attribute('src') if img != 'Error' else 'Error'
-                    r_set.add((time_stamp.text, author_name.text, message.text, img_src))
-
-                except Exception as e:
-                    print('Fatal Error: {0}'.format(title), str(e), file=sys.stderr)
-                    self.driver.switch_to.default_content()
-                    self.driver.close()
-                    return []
+            except Exception as e:
+                print('Fatal Error: {0}'.format(title), str(e), file=sys.stderr)
+                return None
 
             time_to_crawl_in_one_epoch = time() - start_time
-            print('P{5} | {6} | Interval {1}/{4}, {2} chats | {0} | {3}s'.format(
-                title, i + 1, len(r_set), time_to_crawl_in_one_epoch, epochs, os.getpid(), play_time,
+            print('P{5} | {6} | Interval {1}/{4}, {2} chats (+{7}) | {0} | {3}s'.format(
+                title, i + 1, new_chat_counts, time_to_crawl_in_one_epoch, epochs, os.getpid(), play_time,
+                new_chat_counts_in_one_epoch,
             ))
 
             # Resume
             self.click_play_toggle()
 
-        self.driver.switch_to.default_content()
-        self.driver.close()
-        cprint('P{0} | {2} | End | {1}'.format(os.getpid(), title, play_time), 'blue')
+        return new_chat_counts
+
+    def crawl_by_observer(self, writer: WriterWrapper or None, title: str, play_time: str,
+                          time_in_sec: int) -> int or None:
+        """
+        Drain chats captured by the observer every drain_interval_in_sec until the video ends.
+        :param time_in_sec: remaining time of the video in sec
+        :return: number of new chats, or None if a fatal error occurs
+        """
+        try:
+            self.install_chat_observer()
+        except Exception as e:
+            print('Fatal Error: {0}'.format(title), str(e), file=sys.stderr)
+            return None
+
+        # Stop even if 'ended' is never reported, e.g. the video is stuck in buffering.
+        deadline = time() + 1.5 * time_in_sec / self.video_speed_rate + 60
+        new_chat_counts = 0
+        i, is_ended = 0, False
+        while not is_ended and time() < deadline:
+
+            sleep(self.drain_interval_in_sec)
+
+            start_time = time()
+            try:
+                chat_tuples, is_ended = self.drain_chat_queue()
+                new_chat_counts_in_one_drain = self.write_new_chat_tuples(writer, chat_tuples)
+                new_chat_counts += new_chat_counts_in_one_drain
+
+            except Exception as e:
+                print('Fatal Error: {0}'.format(title), str(e), file=sys.stderr)
+                return None
 
-        return [{
-            'time_stamp': tup[0],
-            'author_name': tup[1],
-            'message': tup[2],
-            'img': tup[3],
-        } for tup in r_set]
+            i += 1
+            if new_chat_counts_in_one_drain or is_ended:
+                print('P{4} | {5} | Drain {1}, {2} chats (+{6}) | {0} | {3}s'.format(
+                    title, i, new_chat_counts, time() - start_time, os.getpid(), play_time,
+                    new_chat_counts_in_one_drain,
+                ))
+
+        return new_chat_counts
 
     def export(self):
-        urls = self.get_urls()
-        for url_dict in urls:
-            self.export_one(url_dict)
+        try:
+            for url_dict in self.get_urls_to_crawl():
+                self.record(url_dict, self.export_one(url_dict, report=self.record))
+        finally:
+            self.quit_driver()
 
-    def export_one(self, url_dict):
-        # Run until its success.
+    def read_tail_of_chat_file(self, file_name: str) -> tuple:
+        """
+        :param file_name: chat file written by export_one
+        :return: (number of rows, list of the last max_recent_chats chat tuples)
+        """
+        row_counts, tail = 0, deque(maxlen=self.max_recent_chats)
+        with open(file_name, 'r', encoding='utf-8') as f:
+            for line_dict in csv.DictReader(f):
+                row_counts += 1
+                tail.append(tuple(line_dict[k] for k in self.fieldnames))
+        return row_counts, list(tail)
+
+    def export_one(self, url_dict, report: Callable = None) -> dict:
+        """
+        Append chats of the video to its file, resuming from the file in the manifest if exists.
+        :param url_dict: {'title', 'video_url', 'time'}
+        :param report: def func(url_dict, record): ..., called with a 'partial' record when the file is opened
+        :return: record for the manifest {'status', 'rows', 'file_name', 'attempt_counts'}
+        """
+        self.recent_chat_tuples.clear()
+        prev_record = self.manifest.get(url_dict['video_url'])
+
+        if prev_record and prev_record['file_name'] and os.path.isfile(prev_record['file_name']):
+            row_counts, tail = self.read_tail_of_chat_file(prev_record['file_name'])
+            writer = WriterWrapper(None, self.fieldnames, append_to=prev_record['file_name'])
+            self.write_new_chat_tuples(None, tail)
+        else:
+            row_counts, tail = 0, []
+            writer = WriterWrapper(os.path.join(CHAT_PATH, '_'.join([self.prefix, url_dict['title'], url_dict['time']])),
+                                   self.fieldnames)
+
+        if report:
+            report(url_dict, {'status': 'partial', 'rows': row_counts, 'file_name': writer.file_name,
+                              'attempt_counts': 0})
+
+        # Run until its success, resuming from the last persisted chat.
         attempt_counts = 0
-        result_run_one = []
+        resume_time_stamp = tail[-1][0] if tail else None
+        new_chat_counts = None
 
-        while len(result_run_one) == 0:
-            result_run_one = self.run_one(url_dict)
+        while new_chat_counts is None or row_counts == 0:
+            new_chat_counts = self.run_one(url_dict, writer, resume_time_stamp)
             attempt_counts += 1
+            row_counts += new_chat_counts or 0
+
+            if self.recent_chat_tuples:
+                resume_time_stamp = next(reversed(self.recent_chat_tuples))[0]
 
             if attempt_counts >= 8:
                 cprint('{0} | Error, attempt_counts >= 8'.format(url_dict['title']), 'red')
                 break
 
-        # Write
-        writer = WriterWrapper(os.path.join(CHAT_PATH, '_'.join([self.prefix, url_dict['title'], url_dict['time']])),
-                               self.fieldnames)
-        for line in result_run_one:
-            writer.write_row(line)
         writer.close()
 
-    def export_with_multiprocess(self, processes=4, resume_interval_in_min=5):
+        return {
+            'status': 'done' if (new_chat_counts is not None and row_counts > 0) else 'failed',
+            'rows': row_counts,
+            'file_name': writer.file_name,
+            'attempt_counts': attempt_counts,
+        }
+
+    def export_worker(self, job_queue: Queue, done_queue: Queue):
+        """
+        Export url_dicts from job_queue with one long-lived driver until it gets None,
+        and put (url_dict, record) to done_queue for every job.
+        A 'partial' record is also put when a job opens its file, so that a crashed run can resume from it.
+        The manifest is updated only by the parent process.
+        """
+        def report(_url_dict, _record):
+            done_queue.put((_url_dict, _record))
+
+        try:
+            for url_dict in iter(job_queue.get, None):
+                try:
+                    record = self.export_one(url_dict, report=report)
+                except Exception as e:
+                    print('P{0} | Error: export_one | {1}'.format(os.getpid(), url_dict['title']), e,
+                          file=sys.stderr)
+                    # Keep rows and file_name of the 'partial' record, to resume from its file.
+                    record = {'status': 'failed', 'rows': None, 'file_name': None, 'attempt_counts': 1}
+                done_queue.put((url_dict, record))
+        finally:
+            self.quit_driver()
+
+    def export_with_multiprocess(self, processes=4):
         print('Start crawling with {0} processes'.format(processes))
 
-        process_list = []
+        # Longest video first to minimize the makespan.
+        url_dict_list = sorted(self.get_urls_to_crawl(), key=lambda url_dict: -iso2sec(url_dict['time']))
 
-        for url_dict in self.get_urls():
-            process = Process(target=self.export_one, args=(url_dict,))
+        job_queue, done_queue = Queue(), Queue()
+        for url_dict in url_dict_list:
+            job_queue.put(url_dict)
+        for _ in range(processes):
+            job_queue.put(None)
+
+        process_list = []
+        for _ in range(processes):
+            process = Process(target=self.export_worker, args=(job_queue, done_queue))
             process.start()
             process_list.append(process)
 
-            while len(process_list) >= processes:
-                sleep(60*resume_interval_in_min)
-                process_list = [process for process in process_list if process.is_alive()]
+        done_counts = 0
+        while done_counts < len(url_dict_list):
+            try:
+                url_dict, record = done_queue.get(timeout=60)
+            except Empty:
+                # Every worker died without reporting the rest of the jobs.
+                if not [process for process in process_list if process.is_alive()]:
+                    cprint('Error, all workers died | {0}/{1} done'.format(done_counts, len(url_dict_list)), 'red')
+                    break
+                continue
+            self.record(url_dict, record)
+            if record['status'] == 'partial':
+                continue
+            done_counts += 1
+            print('Done {0}/{1} | {2}, {3} rows | {4}'.format(
+                done_counts, len(url_dict_list), record['status'], record['rows'], url_dict['title'],
+            ))
 
         for process in process_list:
             process.join()
@@ -224,8 +655,7 @@ class ChatCrawler(BaseCrawler):
 
 
 if __name__ == '__main__':
-    crawler = ChatCrawler('./config.ini')
+    crawler = ChatCrawler('./config.ini', extraction_mode='script')
     crawler.export_with_multiprocess(
         processes=4,
-        resume_interval_in_min=1,
     )
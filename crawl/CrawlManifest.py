@@ -0,0 +1,60 @@
+from utill import open_atomic
+import json
+import os
+
+
+class CrawlManifest:
+
+    def __init__(self, path: str):
+        """
+        :param path: path of .json file that persists records of crawled videos
+            {
+                video_url: {
+                    'title': 'FIFA World Cup™ 2018: ...',
+                    'status': 'done' or 'failed',
+                    'rows': 1234,
+                    'file_name': '../data/chats/Chat_..._2018-07-20 12:34:56.789.csv',
+                    'attempt_counts': 1,
+                },
+            }
+        """
+        self.path = path
+        self.video_url_to_record = {}
+
+        if os.path.isfile(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.video_url_to_record = json.load(f)
+
+    def __len__(self):
+        return len(self.video_url_to_record)
+
+    def __contains__(self, video_url):
+        return video_url in self.video_url_to_record
+
+    def get(self, video_url: str) -> dict:
+        return self.video_url_to_record.get(video_url)
+
+    def is_done(self, video_url: str) -> bool:
+        record = self.get(video_url)
+        return bool(record) and record['status'] == 'done'
+
+    def update(self, video_url: str, title: str, status: str, rows: int = None, file_name: str = None,
+               attempt_counts: int = 0):
+        """
+        Update the record of video_url and dump the manifest. attempt_counts is accumulated over runs.
+        rows and file_name of the previous record are kept if they are None,
+        e.g. a failure keeps pointing at the partial file to resume from.
+        """
+        prev_record = self.get(video_url) or {}
+        self.video_url_to_record[video_url] = {
+            'title': title,
+            'status': status,
+            'rows': rows if rows is not None else prev_record.get('rows', 0),
+            'file_name': file_name if file_name is not None else prev_record.get('file_name'),
+            'attempt_counts': prev_record.get('attempt_counts', 0) + attempt_counts,
+        }
+        self.dump()
+
+    def dump(self):
+        with open_atomic(self.path, 'w', encoding='utf-8') as f:
+            json.dump(self.video_url_to_record, f, ensure_ascii=False, indent=2)
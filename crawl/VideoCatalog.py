@@ -0,0 +1,122 @@
+from utill import iso2sec, open_atomic
+from collections import OrderedDict
+from contextlib import contextmanager
+import csv
+import datetime
+import os
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no fcntl, where updates of the catalog are not locked.
+    fcntl = None
+
+
+class VideoCatalog:
+
+    def __init__(self, path: str):
+        """
+        :param path: path of .csv file that persists videos found by VideoURLCrawler, keyed by video_url
+            title | video_url | time | time_in_sec | first_seen | last_seen | status
+            status is 'new' when found, and the status of ChatCrawler ('partial', 'done', 'failed') after crawled.
+
+        Each update reads the file again and writes it while holding a lock on path + '.lock',
+        so that processes sharing the catalog (e.g. VideoURLCrawler.export while ChatCrawler runs for hours)
+        do not overwrite videos of each other. The lock needs fcntl, which is not on Windows.
+        """
+        self.path = path
+        self.fieldnames = ['title', 'video_url', 'time', 'time_in_sec', 'first_seen', 'last_seen', 'status']
+        self.video_url_to_video: OrderedDict = OrderedDict()
+        self.load()
+
+    def load(self):
+        self.video_url_to_video = OrderedDict()
+        if os.path.isfile(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for video_dict in csv.DictReader(f):
+                    self.video_url_to_video[video_dict['video_url']] = video_dict
+
+    @contextmanager
+    def lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def __len__(self):
+        return len(self.video_url_to_video)
+
+    def __contains__(self, video_url):
+        return video_url in self.video_url_to_video
+
+    def __iter__(self):
+        return iter(self.video_url_to_video.values())
+
+    def get_video_urls(self) -> set:
+        return set(self.video_url_to_video.keys())
+
+    def get_url_dicts(self) -> list:
+        """
+        :return: list of url_dict {'title', 'video_url', 'time'} for ChatCrawler,
+            except videos whose time cannot be parsed
+        """
+        return [{k: video_dict[k] for k in ['title', 'video_url', 'time']}
+                for video_dict in self.video_url_to_video.values() if video_dict['time_in_sec'] != '']
+
+    def merge(self, video_dict_list: list) -> int:
+        """
+        :param video_dict_list: list of {'title', 'video_url', 'time'} from VideoURLCrawler.run
+        :return: number of new videos
+            Videos whose time cannot be parsed (e.g. live streams) are skipped.
+        """
+        with self.lock():
+            self.load()
+            now = str(datetime.datetime.now())
+            new_counts, skipped_counts = 0, 0
+            for video_dict in video_dict_list:
+                try:
+                    time_in_sec = iso2sec(video_dict['time'])
+                except Exception:
+                    skipped_counts += 1
+                    continue
+
+                prev_video_dict = self.video_url_to_video.get(video_dict['video_url'])
+                if prev_video_dict:
+                    prev_video_dict.update({'title': video_dict['title'], 'time': video_dict['time'],
+                                            'time_in_sec': time_in_sec, 'last_seen': now})
+                    continue
+
+                self.video_url_to_video[video_dict['video_url']] = {
+                    'title': video_dict['title'],
+                    'video_url': video_dict['video_url'],
+                    'time': video_dict['time'],
+                    'time_in_sec': time_in_sec,
+                    'first_seen': now,
+                    'last_seen': now,
+                    'status': 'new',
+                }
+                new_counts += 1
+
+            if skipped_counts:
+                print('{0} videos are skipped, since their time cannot be parsed'.format(skipped_counts))
+            self.dump()
+        return new_counts
+
+    def set_status(self, video_url: str, status: str):
+        with self.lock():
+            self.load()
+            if video_url in self.video_url_to_video:
+                self.video_url_to_video[video_url]['status'] = status
+                self.dump()
+
+    def dump(self):
+        with open_atomic(self.path, 'w', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=self.fieldnames)
+            writer.writeheader()
+            for video_dict in self.video_url_to_video.values():
+                writer.writerow(video_dict)
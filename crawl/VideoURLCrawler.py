@@ -1,14 +1,45 @@
-from custom_path import DATA_PATH
+from custom_path import VIDEO_CATALOG_PATH
 from utill import get_driver
 from BaseCrawler import BaseCrawler
-from WriterWrapper import WriterWrapper
-from time import sleep
-import os
+from VideoCatalog import VideoCatalog
+from time import sleep, time
+
+
+# Return {count: number of video cards, found: whether a card links to one of window.knownVideoUrls}.
+COUNT_CARDS_SCRIPT = '''
+var anchors = document.querySelectorAll('#dismissable #video-title');
+var known = window.knownVideoUrls || new Set();
+for (var i = 0; i < anchors.length; i++) {
+    if (known.has(anchors[i].href)) { return {count: anchors.length, found: true}; }
+}
+return {count: anchors.length, found: false};
+'''
+
+# Return [{title, video_url, time}] of video cards whose lower-cased title contains one of arguments[0].
+EXTRACT_CARDS_SCRIPT = '''
+var searchTexts = arguments[0] || [];
+var rows = [];
+var divs = document.querySelectorAll('#dismissable');
+for (var i = 0; i < divs.length; i++) {
+    var anchor = divs[i].querySelector('#video-title');
+    var playTime = divs[i].querySelector('.ytd-thumbnail-overlay-time-status-renderer');
+    if (!anchor) { continue; }
+    var title = anchor.innerText;
+    var isMatched = searchTexts.length === 0 || searchTexts.some(function (text) {
+        return title.toLowerCase().indexOf(text) >= 0;
+    });
+    if (isMatched) {
+        rows.push({title: title, video_url: anchor.href, time: playTime ? playTime.innerText.trim() : ''});
+    }
+}
+return rows;
+'''
 
 
 class VideoURLCrawler(BaseCrawler):
 
-    def __init__(self, config_file_path: str, target_url: str, number_of_scroll: int=6):
+    def __init__(self, config_file_path: str, target_url: str, number_of_scroll: int=6,
+                 driver_profile: dict=None, scroll_mode: str='fixed', scroll_timeout_in_sec: float=3.0):
         """
         :param config_file_path: path of .ini file
             config.ini
@@ -16,20 +47,47 @@ class VideoURLCrawler(BaseCrawler):
                 PATH="Something"
         :param target_url: the url of video list.
         :param number_of_scroll: number of scrolls to load a video list.
+            In 'adaptive' mode, the maximum number of scrolls.
+        :param driver_profile: keys and values that override the [DRIVER] section, e.g. {'HEADLESS': 'true'}
+        :param scroll_mode: 'fixed' or 'adaptive'
+            'fixed': scroll number_of_scroll times, and read cards one by one.
+            'adaptive': scroll until the number of cards stops increasing in scroll_timeout_in_sec,
+                or a card of known_video_urls appears, and extract matched cards with one script.
+        :param scroll_timeout_in_sec: time to wait for new cards after a scroll (only for 'adaptive')
         """
-        super().__init__(config_file_path)
+        super().__init__(config_file_path, driver_profile)
         self.url = target_url
         self.fieldnames = ['title', 'video_url', 'time']
         self.prefix = 'VideoURL'
         self.number_of_scroll = number_of_scroll
 
-    def run(self, search_text_list: list=None) -> list:
+        if scroll_mode not in ('fixed', 'adaptive'):
+            raise ValueError('scroll_mode should be fixed or adaptive, not {0}'.format(scroll_mode))
+        self.scroll_mode = scroll_mode
+        self.scroll_timeout_in_sec = scroll_timeout_in_sec
+
+    def run(self, search_text_list: list=None, known_video_urls: set=None) -> list:
         """
         :param search_text_list: text_list to search
+        :param known_video_urls: urls already crawled, scrolling stops when one of them appears (only for 'adaptive')
         :return: list of videos that contain 'search_text'
         """
-        self.driver = get_driver(self.config_file_path)
+        self.driver = get_driver(self.config_file_path, self.driver_profile)
         self.driver.get(self.url)
+
+        if self.scroll_mode == 'adaptive':
+            self.scroll_until_stable(known_video_urls)
+            r = self.driver.execute_script(EXTRACT_CARDS_SCRIPT, search_text_list or [])
+            for video_dict in r:
+                print(video_dict['title'], video_dict['video_url'], video_dict['time'])
+        else:
+            r = self.run_fixed_scroll(search_text_list)
+
+        self.driver.close()
+
+        return r
+
+    def run_fixed_scroll(self, search_text_list: list=None) -> list:
         r = []
 
         for _ in range(self.number_of_scroll):
@@ -51,19 +109,47 @@ class VideoURLCrawler(BaseCrawler):
                 })
                 print(title, video_url, play_time)
 
-        self.driver.close()
-
         return r
 
-    def export(self, search_text_list: list=None):
+    def scroll_until_stable(self, known_video_urls: set=None) -> int:
+        """
+        Scroll to the bottom until the number of cards stops increasing or a known video appears.
+        :return: number of cards
+        """
+        self.driver.execute_script('window.knownVideoUrls = new Set(arguments[0]);', list(known_video_urls or []))
+        state = self.driver.execute_script(COUNT_CARDS_SCRIPT)
+
+        for i in range(self.number_of_scroll):
+            if state['found']:
+                print('Scroll {0}: a known video appears, {1} cards'.format(i, state['count']))
+                break
+
+            prev_count = state['count']
+            self.driver.execute_script('window.scrollTo(0, document.documentElement.scrollHeight);')
+
+            deadline = time() + self.scroll_timeout_in_sec
+            while time() < deadline:
+                sleep(0.2)
+                state = self.driver.execute_script(COUNT_CARDS_SCRIPT)
+                if state['count'] > prev_count or state['found']:
+                    break
+
+            if state['count'] <= prev_count:
+                print('Scroll {0}: no more cards, {1} cards'.format(i + 1, state['count']))
+                break
+
+        return state['count']
+
+    def export(self, search_text_list: list=None, catalog_path: str=None):
         """
+        Merge found videos into the catalog. In 'adaptive' mode, scrolling stops at videos already in the catalog.
         :param search_text_list: text to search
+        :param catalog_path: path of the video catalog, VIDEO_CATALOG_PATH by default
         """
-        result = self.run(search_text_list=search_text_list)
-        writer = WriterWrapper(os.path.join(DATA_PATH, self.prefix), self.fieldnames)
-        for line in result:
-            writer.write_row(line)
-        writer.close()
+        catalog = VideoCatalog(catalog_path or VIDEO_CATALOG_PATH)
+        result = self.run(search_text_list=search_text_list, known_video_urls=catalog.get_video_urls())
+        new_counts = catalog.merge(result)
+        print('{0} new videos, {1} videos in the catalog'.format(new_counts, len(catalog)))
 
 
 if __name__ == '__main__':
@@ -71,5 +157,6 @@ if __name__ == '__main__':
         config_file_path='./config.ini',
         target_url='https://www.youtube.com/user/FIFATV/videos',
         number_of_scroll=50,
+        scroll_mode='adaptive',
     )
     crawler.export(search_text_list=['pc', 'conference', 'confernence'])
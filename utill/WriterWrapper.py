@@ -1,20 +1,38 @@
 # -*- coding: utf-8 -*-
 
 import csv
+import os
 import datetime
 
 
 class WriterWrapper:
 
-    def __init__(self, _filename: str, _fieldnames: list):
-        file_name = (_filename + '_{0}.csv').format(datetime.datetime.now())
-        self.f = open(file_name, 'w', encoding='utf-8')
-        self.wr = csv.DictWriter(self.f, fieldnames=_fieldnames)
-        self.wr.writeheader()
+    def __init__(self, _filename: str, _fieldnames: list, append_to: str = None):
+        """
+        :param _filename: prefix of the file name, to which '_{datetime}.csv' is appended
+        :param _fieldnames: list of str
+        :param append_to: name of an existing file to append rows to, instead of creating a new file
+        """
+        if append_to:
+            self.file_name = append_to
+            self.f = open(append_to, 'a', encoding='utf-8')
+            self.wr = csv.DictWriter(self.f, fieldnames=_fieldnames)
+        else:
+            self.file_name = (_filename + '_{0}.csv').format(datetime.datetime.now())
+            self.f = open(self.file_name, 'w', encoding='utf-8')
+            self.wr = csv.DictWriter(self.f, fieldnames=_fieldnames)
+            self.wr.writeheader()
 
     def write_row(self, dct: dict):
         self.wr.writerow(dct)
 
+    def write_rows(self, dct_list: list):
+        self.wr.writerows(dct_list)
+
+    def flush(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
     def close(self):
         self.f.close()
 
@@ -2,5 +2,6 @@ import os
 
 DATA_PATH = '../data'
 CHAT_PATH = os.path.join(DATA_PATH, 'chats')
+VIDEO_CATALOG_PATH = os.path.join(DATA_PATH, 'VideoCatalog.csv')
 FASTTEXT_VEC_PATH = '../../../fasttext_vectors'
 MUSE_PATH = os.path.join(FASTTEXT_VEC_PATH, 'muse')
@@ -1,8 +1,13 @@
 import os
 import sys
 import re
-from time import sleep, time
+from time import time
+from contextlib import contextmanager
 from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.remote.webelement import WebElement
+from selenium.webdriver.support import expected_conditions
+from selenium.webdriver.support.ui import WebDriverWait
 from typing import List, Callable, Tuple
 import configparser
 
@@ -70,6 +75,26 @@ def get_files_with_dir_path(path: str, search_text: str = None) -> list:
     return [os.path.join(path, f) for f in get_files(path, search_text)]
 
 
+@contextmanager
+def open_atomic(path: str, mode: str = 'w', **kwargs):
+    """
+    Open a temporary file next to path, which replaces path only if the block ends without an error,
+    so that readers and crashed runs never see a partial file.
+    The temporary file has the pid, so that processes writing the same path do not share it.
+    :param path: path to write
+    :param mode: 'w' or 'wb'
+    :param kwargs: kwargs of open, e.g. encoding='utf-8'
+    """
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    try:
+        with open(tmp_path, mode, **kwargs) as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
 def try_except(f):
     """
     :param f: function that use this decorator
@@ -84,36 +109,112 @@ def try_except(f):
     return wrapper
 
 
-def try_except_with_sleep(f):
+def try_except_with_wait(f):
     """
-    :param f: function that use this decorator
-    :return:
+    :param f: method that waits by conditions (e.g. wait_until_clickable), not by sleep
+    :return: wrapper that adds the time consumed by f to self.action_to_waited_time[f.__name__] if it exists
     """
-    def wrapper(*args, **kwargs):
+    def wrapper(self, *args, **kwargs):
+        start_time = time()
         try:
-            sleep(0.6)
-            result = f(*args, **kwargs)
-            sleep(0.6)
-            return result
+            return f(self, *args, **kwargs)
         except Exception as e:
             print('P{0} | Error: {1}'.format(os.getpid(), f.__name__), e, file=sys.stderr)
+        finally:
+            action_to_waited_time = getattr(self, 'action_to_waited_time', None)
+            if action_to_waited_time is not None:
+                action_to_waited_time[f.__name__] += time() - start_time
 
     return wrapper
 
 
-def get_driver(config_file_path: str) -> webdriver.Chrome:
+def wait_until_present(driver: webdriver.Chrome, css_selector: str,
+                       timeout: float = 5.0, poll_frequency: float = 0.1) -> WebElement:
+    """
+    :return: the element as soon as it is in the DOM, raise TimeoutException after timeout sec
+    """
+    return WebDriverWait(driver, timeout, poll_frequency=poll_frequency).until(
+        expected_conditions.presence_of_element_located((By.CSS_SELECTOR, css_selector))
+    )
+
+
+def wait_until_clickable(driver: webdriver.Chrome, css_selector: str,
+                         timeout: float = 5.0, poll_frequency: float = 0.1) -> WebElement:
+    """
+    :return: the element as soon as it is visible and enabled, raise TimeoutException after timeout sec
+    """
+    return WebDriverWait(driver, timeout, poll_frequency=poll_frequency).until(
+        expected_conditions.element_to_be_clickable((By.CSS_SELECTOR, css_selector))
+    )
+
+
+# Driver profile in the [DRIVER] section of config.ini, e.g.
+#   [DRIVER]
+#   PATH=/usr/local/bin/chromedriver
+#   HEADLESS=true
+#   LOAD_IMAGES=false
+#   DISABLE_GPU=true
+#   DISABLE_EXTENSIONS=true
+#   WINDOW_SIZE=640,360
+#   VIDEO_QUALITY=tiny
+DEFAULT_DRIVER_PROFILE = {
+    'INCOGNITO': 'true',
+    'HEADLESS': 'false',
+    'LOAD_IMAGES': 'true',
+    'DISABLE_GPU': 'false',
+    'DISABLE_EXTENSIONS': 'false',
+    'WINDOW_SIZE': '',
+    'VIDEO_QUALITY': '',
+}
+
+
+def is_true(s: str) -> bool:
+    return str(s).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def get_driver_profile(config_file_path: str, profile: dict = None) -> dict:
+    """
+    :param config_file_path: path of .ini file
+    :param profile: keys and values that override the [DRIVER] section, e.g. {'HEADLESS': 'true'}
+    :return: DEFAULT_DRIVER_PROFILE updated by the [DRIVER] section and profile, whose keys are in upper case
+    """
+    config = configparser.ConfigParser()
+    config.read(config_file_path)
+    driver_profile = dict(DEFAULT_DRIVER_PROFILE)
+    driver_profile.update({k.upper(): v for k, v in config['DRIVER'].items()})
+    driver_profile.update({k.upper(): str(v) for k, v in (profile or {}).items()})
+    return driver_profile
+
+
+def get_driver(config_file_path: str, profile: dict = None) -> webdriver.Chrome:
     """
     :param config_file_path: path of .ini file
         config.ini
             [Driver]
             PATH="Something"
+            (and optional keys of DEFAULT_DRIVER_PROFILE)
+    :param profile: keys and values that override the [DRIVER] section
     :return: webdriver.Chrome
     """
+    driver_profile = get_driver_profile(config_file_path, profile)
+
     chrome_options = webdriver.ChromeOptions()
-    chrome_options.add_argument("--incognito")
-    config = configparser.ConfigParser()
-    config.read(config_file_path)
-    driver = webdriver.Chrome(config['DRIVER']['PATH'], chrome_options=chrome_options)
+    if is_true(driver_profile['INCOGNITO']):
+        chrome_options.add_argument("--incognito")
+    if is_true(driver_profile['HEADLESS']):
+        chrome_options.add_argument("--headless")
+        chrome_options.add_argument("--mute-audio")
+    if is_true(driver_profile['DISABLE_GPU']):
+        chrome_options.add_argument("--disable-gpu")
+    if is_true(driver_profile['DISABLE_EXTENSIONS']):
+        chrome_options.add_argument("--disable-extensions")
+    if driver_profile['WINDOW_SIZE']:
+        chrome_options.add_argument("--window-size={0}".format(driver_profile['WINDOW_SIZE']))
+    if not is_true(driver_profile['LOAD_IMAGES']):
+        # Images are not downloaded, but src of avatars is still in the DOM, which is all we crawl.
+        chrome_options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+
+    driver = webdriver.Chrome(driver_profile['PATH'], chrome_options=chrome_options)
     driver.implicitly_wait(3)
     return driver
 